@@ -1,30 +1,96 @@
 """Base class for all agent implementations."""
 
+import os
+import time
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import orjson
+from json_repair import repair_json
+
+# Upper bound on concurrent LLM calls made by AgentBase.run_batch, overridable per deployment.
+AGENT_MAX_CONCURRENCY = int(os.environ.get('AGENT_MAX_CONCURRENCY', 16))
+
+# Max prompts held by the process-wide prompt cache, about nine per client, overridable per deployment.
+PROMPT_CACHE_MAXSIZE = int(os.environ.get('PROMPT_CACHE_MAXSIZE', 256))
+
+# Process-wide LRU prompt cache, shared by every agent instance.
+# Key: (client, file_path). Value: (modification_time, content, time the modification time was checked)
+_prompt_cache = OrderedDict()
+_prompt_cache_lock = threading.Lock()
+
+def _prompt_cache_get(cache_key):
+    """
+    Get a prompt cache entry, marking it as most recently used.
+
+    Args:
+        cache_key (tuple): The (client, file_path) key.
+
+    Returns:
+        tuple: The cache entry, or None if the prompt isn't cached.
+    """
+    with _prompt_cache_lock:
+        cached = _prompt_cache.get(cache_key)
+        if cached is not None:
+            _prompt_cache.move_to_end(cache_key)
+        return cached
+
+def _prompt_cache_put(cache_key, entry):
+    """
+    Add or replace a prompt cache entry, evicting the least recently used beyond PROMPT_CACHE_MAXSIZE.
+
+    Args:
+        cache_key (tuple): The (client, file_path) key.
+        entry (tuple): (modification_time, content, checked_at).
+    """
+    with _prompt_cache_lock:
+        _prompt_cache[cache_key] = entry
+        _prompt_cache.move_to_end(cache_key)
+        while len(_prompt_cache) > PROMPT_CACHE_MAXSIZE:
+            _prompt_cache.popitem(last=False)
+
+# Process-wide cache of built prompt | llm chains.
+# Key: (agent class, id(llm), prompt text). Value: (llm, chain), holding llm so its id can't be reused.
+_chain_cache = {}
+
+# Prompt files read by the agents, loaded up front by AgentBase.warm_prompts
+PROMPT_FILES = [
+    'prompt_emailproposalagent.txt',
+    'prompt_resultscomparisonagent.txt',
+    'prompt_searchresultsrankingagent.txt',
+    'prompt_searchproposalagent.txt',
+    'prompt_targetscoreagent.txt',
+    'prompt_urlextractionagent.txt',
+    'prompt_standardquery.txt',
+]
+
 #======================================================================================
 # Agent Classes
 #======================================================================================
 
-class AgentBase:
+class ToolBase:
     """
-    Base class for all agent implementations.
+    Base class for search tools and agents, which call paid external services.
 
-    This class provides common functionality for logging consumption
-    and loading prompts from files with caching.
+    This class provides common functionality for logging consumption.
+    Search tools without an LLM chain (e.g. Tavily, Brave) derive from it directly.
     """
+
     def __init__(self, app):
         """
-        Initialize the AgentBase.
+        Initialize the ToolBase.
 
         Args:
             app: The main application instance.
         """
         self.app = app
-        self.prompt_cache = {}
         self.storage_manager = app.storage_manager
 
-    async def log_consumption(self, function_name, model, search_calls, input_tokens, output_tokens):
+    def log_consumption(self, function_name, model, search_calls, input_tokens, output_tokens):
         """
-        Log the LLM's consumption (i.e. tokens, searches) for the agent.
+        Log the consumption (i.e. tokens, searches) of the tool or agent.
 
         Args:
             function_name (str): Name of the function being logged.
@@ -46,13 +112,209 @@ class AgentBase:
         # self.app.logger.info(f"Consumption: {consumption}")
         return consumption
 
+class AgentBase(ToolBase, ABC):
+    """
+    Base class for all LLM agent implementations.
+
+    This class provides common functionality for logging consumption
+    and loading prompts from files with caching. Agents must implement build_chain().
+    """
+    # Whether outputs may be reused from the PlanCache for the same candidate and search period
+    cacheable = True
+
+    @staticmethod
+    def parse_tool_args(func_args):
+        """
+        Parse the arguments of an LLM tool call, repairing common LLM malformations
+        (e.g. trailing commas, unquoted keys, markdown fences) if the JSON is invalid.
+
+        Args:
+            func_args (str | dict): The tool call's arguments, as returned by the LLM.
+
+        Returns:
+            dict: The parsed arguments.
+
+        Raises:
+            ValueError: If the arguments can't be parsed or repaired into an object.
+        """
+        if isinstance(func_args, dict):
+            return func_args
+
+        try:
+            func_args_data = orjson.loads(func_args)
+        except orjson.JSONDecodeError:
+            func_args_data = repair_json(func_args, return_objects=True)
+
+        if not isinstance(func_args_data, dict):
+            raise ValueError(f"Invalid JSON in tool call arguments: {func_args[:200]}")
+        return func_args_data
+
+    def parse_structured_response(self, response, schema):
+        """
+        Get the parsed output of a with_structured_output(..., include_raw=True) chain.
+        If the provider's arguments failed to parse, they are repaired and validated against the schema.
+
+        Args:
+            response (dict): The chain's response, with 'raw', 'parsed' and 'parsing_error' keys.
+            schema (Type[BaseModel]): The structured output model.
+
+        Returns:
+            BaseModel: The parsed output.
+
+        Raises:
+            ValueError: If the output can't be parsed, repaired or validated.
+        """
+        if response['parsed'] is not None:
+            return response['parsed']
+
+        try:
+            func_args = response['raw'].additional_kwargs['tool_calls'][0]['function']['arguments']
+        except (KeyError, IndexError) as e:
+            raise ValueError(f"No tool call in response: {response['parsing_error']}") from e
+        return schema.parse_obj(self.parse_tool_args(func_args))
+
+    async def run_item(self, llm, item, client):
+        """
+        Run the agent for a single item of a batch. Agents whose run() does not take
+        a params dict should override this to unpack the item.
+
+        Args:
+            llm: The language model to use.
+            item (dict): The parameters for one call of run().
+            client (str): The client identifier.
+
+        Returns:
+            The result of self.run() for this item.
+        """
+        return await self.run(llm, item, client)
+
+    async def run_batch(self, llm, items, client, max_concurrency=None):
+        """
+        Run the agent over many items concurrently, bounded by a semaphore.
+        Items which raise are retried once individually, rather than retrying the whole batch.
+
+        Args:
+            llm: The language model to use.
+            items (list): The items to process, see run_item().
+            client (str): The client identifier.
+            max_concurrency (int, optional): Max concurrent calls. Defaults to AGENT_MAX_CONCURRENCY.
+
+        Returns:
+            list: The results of run_item(), in the same order as items.
+                  An item which fails on retry is returned as its exception.
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or AGENT_MAX_CONCURRENCY)
+
+        async def run_one(item):
+            async with semaphore:
+                return await self.run_item(llm, item, client)
+
+        results = await asyncio.gather(*(run_one(item) for item in items), return_exceptions=True)
+
+        for index, result in enumerate(results):
+            if isinstance(result, Exception):
+                try:
+                    results[index] = await run_one(items[index])
+                except Exception as e:
+                    msg = f"run_batch, {self.__class__.__name__}: item {index} failed after retry: {str(e)}"
+                    self.app.handle_error(logging.ERROR, msg, e)
+                    results[index] = e
+
+        return results
+
+    @abstractmethod
+    def build_chain(self, llm, prompt_text):
+        """
+        Build the agent's runnable chain from its prompt text, as used by get_chain().
+
+        Args:
+            llm: The language model to use.
+            prompt_text (str): The agent's prompt, as read from file.
+
+        Returns:
+            Runnable: The chain to invoke.
+        """
+
+    async def get_chain(self, llm, client, prompt_file):
+        """
+        Get the agent's chain for this llm and client's prompt, building it only on first use.
+        The prompt text is part of the key, so a refreshed prompt file gets a new chain.
+
+        Args:
+            llm: The language model to use.
+            client (str): The client name, used as a subfolder or blob prefix.
+            prompt_file (str): The filename of the agent's prompt.
+
+        Returns:
+            Runnable: The chain to invoke.
+        """
+        prompt_text = await self.aprompt_from_file(prompt_file, client=client)
+        cache_key = (self.__class__, id(llm), prompt_text)
+
+        cached = _chain_cache.get(cache_key)
+        if cached is not None and cached[0] is llm:
+            return cached[1]
+
+        chain = self.build_chain(llm, prompt_text)
+        _chain_cache[cache_key] = (llm, chain)
+        return chain
+
+    async def warm_prompts(self, client):
+        """
+        Read all of a client's prompt files concurrently into the shared prompt cache,
+        so agents don't pay for cold reads one after another as they start.
+
+        Args:
+            client (str): The client name, used as a subfolder or blob prefix.
+        """
+        file_paths = PROMPT_FILES + [self.app.config['BUSINESS_DESCRIPTION_FILENAME'],
+                                     self.app.config['EMAIL_TEMPLATE_FILENAME']]
+        await asyncio.gather(*[asyncio.to_thread(self.prompt_from_file, file_path, client)
+                               for file_path in file_paths])
+
+    def prompt_check_due(self, cached):
+        """
+        Whether a cached prompt's modification time should be checked again.
+        Only when PROMPT_CACHE_REFRESH is set, and then at most every PROMPT_CACHE_CHECK_SECONDS,
+        so the hot path isn't a stat (or blob properties request) per call.
+
+        Args:
+            cached (tuple): The cache entry, (modification_time, content, checked_at).
+
+        Returns:
+            bool: True if the file should be checked for changes.
+        """
+        if not self.app.config.get('PROMPT_CACHE_REFRESH', False):
+            return False
+        return time.monotonic() - cached[2] >= self.app.config.get('PROMPT_CACHE_CHECK_SECONDS', 30)
+
+    async def aprompt_from_file(self, file_path, client=None):
+        """
+        Async version of prompt_from_file, for use by the agents' run methods.
+        Cache hits return immediately, while reads run in a thread so the event loop isn't blocked.
+
+        Args:
+            file_path (str): Path to the file containing the prompt.
+            client (str, optional): The client name, used as a subfolder or blob prefix.
+
+        Returns:
+            str: The content of the prompt file, or None if an error occurs.
+        """
+        cached = _prompt_cache_get((client, file_path))
+        if cached is not None and not self.prompt_check_due(cached):
+            return cached[1]
+
+        return await asyncio.to_thread(self.prompt_from_file, file_path, client)
+
     def prompt_from_file(self, file_path, client=None):
         """
         Load a prompt from a file, with caching for faster execution.
 
         This method uses the StorageManager to read files, supporting both local
-        and cloud storage environments. It also implements caching to improve
-        performance for frequently accessed prompts.
+        and cloud storage environments. The cache is shared by all agents in the
+        process, so each prompt is read once per run rather than once per agent.
+        If the app config sets PROMPT_CACHE_REFRESH, the file's modification time
+        is checked at most every PROMPT_CACHE_CHECK_SECONDS and changed files are re-read.
 
         Args:
             file_path (str): Path to the file containing the prompt.
@@ -61,15 +323,30 @@ class AgentBase:
         Returns:
             str: The content of the prompt file, or None if an error occurs.
         """
-        cache_key = f"{client}:{file_path}" if client else file_path
-        
-        if cache_key not in self.prompt_cache:
-            try:
-                content = self.storage_manager.read_file(file_path, client=client)
-                self.prompt_cache[cache_key] = content
-            except Exception as e:
-                msg = f"prompt_from_file, {self.__class__.__name__}: error reading file {file_path}: {str(e)}"
-                self.app.handle_error(self.app.logger, logging.CRITICAL, msg)
-                return None
-        
-        return self.prompt_cache.get(cache_key)
\ No newline at end of file
+        cache_key = (client, file_path)
+        refresh = self.app.config.get('PROMPT_CACHE_REFRESH', False)
+
+        try:
+            cached = _prompt_cache_get(cache_key)
+            if cached is not None and not self.prompt_check_due(cached):
+                return cached[1]
+
+            modification_time = None
+            checked_at = time.monotonic()
+            if refresh:
+                full_path = self.storage_manager.get_file_path(file_path, client)
+                modification_time = self.storage_manager.get_file_modification_time(full_path)
+
+            if cached is not None and cached[0] == modification_time:
+                _prompt_cache_put(cache_key, (modification_time, cached[1], checked_at))
+                return cached[1]
+
+            content = self.storage_manager.read_file(file_path, client=client)
+            if content is not None:
+                _prompt_cache_put(cache_key, (modification_time, content, checked_at))
+            return content
+
+        except Exception as e:
+            msg = f"prompt_from_file, {self.__class__.__name__}: error reading file {file_path}: {str(e)}"
+            self.app.handle_error(self.app.logger, logging.CRITICAL, msg)
+            return None
@@ -1,42 +1,44 @@
 """Agent for performing searches using the Brave Search API."""
 
-from langchain_community.tools import BraveSearch
-from agents.base import AgentBase
+from agents.base import ToolBase
 import logging
 
-class BraveAgent(AgentBase):
+BRAVE_SEARCH_URL = "https://api.search.brave.com/res/v1/web/search"
+
+class BraveAgent(ToolBase):
     """
     Agent for performing searches using the Brave Search API.
+    Calls the HTTP API directly over the app's shared HTTP client, so connections are reused between searches.
     """
     async def run(self, search_query, config):
         """
-        Execute a search using the Brave search tool and return the results along with consumption details.
-        
+        Execute a search using the Brave search API and return the results along with consumption details.
+
         Args:
             search_query (str): The query to search for.
             config (dict): Configuration containing API key and max searches.
         Returns:
             tuple: A tuple containing the search response and consumption details.
+                   The response is a list of dicts with 'title', 'link' and 'snippet' keys.
         """
         try:
-            # Create the Brave search tool instance
-            search_tool = BraveSearch.from_api_key(
-                api_key=config['BRAVE_API_KEY'], 
-                search_kwargs={"count": config['MAX_BRAVE_SEARCHES']}
-            )
-
-            # Execute the search asynchronously using asyncio.to_thread
-            response_str = await asyncio.to_thread(search_tool.run, search_query)
+            params = {"q": search_query, "count": config['MAX_BRAVE_SEARCHES']}
+            headers = {"X-Subscription-Token": config['BRAVE_API_KEY'], "Accept": "application/json"}
 
-            # Convert the response from string to list using ast.literal_eval for safety
-            response = ast.literal_eval(response_str)
+            # Execute the search over the shared client
+            resp = await self.app.http_client.get(BRAVE_SEARCH_URL, params=params, headers=headers)
+            resp.raise_for_status()
+            data = resp.json()
 
-            # Ensure the response is a list
-            if not isinstance(response, list):
-                raise ValueError("Unexpected response format from Brave search")
+            # The API returns JSON, so build the result dicts directly (no string round trip to parse).
+            # Keep the same fields as the langchain BraveSearch tool returned.
+            response = [
+                {"title": item.get("title"), "link": item.get("url"), "snippet": item.get("description")}
+                for item in data.get("web", {}).get("results", [])
+            ]
 
             # Log the consumption
-            consumption = await self.log_consumption(
+            consumption = self.log_consumption(
                 function_name='brave_tool',
                 model='Brave',
                 search_calls=len(response),
@@ -48,7 +50,7 @@ class BraveAgent(AgentBase):
 
         except Exception as e:
             msg = f"An error occurred while executing brave_tool: {str(e)}"
-            await self.app.handle_error(self.app.logger, logging.ERROR, msg)
+            self.app.handle_error(self.app.logger, logging.ERROR, msg)
             return [], {
                 'function': 'brave_tool',
                 'model': 'Brave',
@@ -7,6 +7,20 @@ from langchain_core.runnables import RunnableSequence
 class EmailProposalAgent(AgentBase):
     """Agent for generating email proposals based on search results."""
 
+    def build_chain(self, llm, prompt_text):
+        """
+        Build the email proposal chain.
+
+        Args:
+            llm: The language model to use for email generation.
+            prompt_text (str): The email proposal prompt.
+
+        Returns:
+            RunnableSequence: The prompt and llm chain.
+        """
+        prompt = ChatPromptTemplate.from_template(prompt_text)
+        return RunnableSequence(prompt, llm)
+
     async def run(self, llm, first_name, last_name, company, search_results, client):
         """
         Generate an email proposal based on search results and business information.
@@ -24,12 +38,9 @@ class EmailProposalAgent(AgentBase):
                 - email_content (str): The generated email content.
                 - consumption (Dict[str, Any]): Details of resource consumption.
         """
-        business_description = self.prompt_from_file(self.app.config['BUSINESS_DESCRIPTION_FILENAME'], client=client)
-        email_template = self.prompt_from_file(self.app.config['EMAIL_TEMPLATE_FILENAME'], client=client)
-        prompt_text = self.prompt_from_file("prompt_emailproposalagent.txt", client=client)
-
-        prompt = ChatPromptTemplate.from_template(prompt_text)
-        chain = RunnableSequence(prompt, llm)
+        business_description = await self.aprompt_from_file(self.app.config['BUSINESS_DESCRIPTION_FILENAME'], client=client)
+        email_template = await self.aprompt_from_file(self.app.config['EMAIL_TEMPLATE_FILENAME'], client=client)
+        chain = await self.get_chain(llm, client, "prompt_emailproposalagent.txt")
 
         prompt_params = {
             'search_name_first': first_name,
@@ -42,7 +53,7 @@ class EmailProposalAgent(AgentBase):
 
         response = await chain.ainvoke(prompt_params)
 
-        consumption = await self.log_consumption(
+        consumption = self.log_consumption(
             function_name='email_proposal_agent',
             model=response.response_metadata['model_name'],
             search_calls=0,
@@ -50,4 +61,19 @@ class EmailProposalAgent(AgentBase):
             output_tokens=response.response_metadata['token_usage']['completion_tokens']
         )
 
-        return response.content, consumption
\ No newline at end of file
+        return response.content, consumption
+
+    async def run_item(self, llm, item, client):
+        """
+        Run the agent for a single item of a batch.
+
+        Args:
+            llm: The language model to use for email generation.
+            item (dict): Contains first_name, last_name, company and search_results.
+            client (str): The name of the client.
+
+        Returns:
+            Tuple[str, Dict[str, Any]]: The email content and consumption, as per run().
+        """
+        return await self.run(llm, item['first_name'], item['last_name'], item['company'],
+                              item['search_results'], client)
\ No newline at end of file
@@ -3,65 +3,263 @@
 from langchain_community.chat_models import ChatPerplexity
 from langchain_core.prompts import ChatPromptTemplate
 from agents.base import AgentBase
-import ast
+import os
+import time
+import asyncio
 import logging
-from tenacity import retry, stop_after_attempt, wait_random_exponential  # for exponential backoff
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential  # for exponential backoff
+
+# Perplexity is an 'online' model, so cached answers go stale. Expire them after a day.
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+
+# Process-wide response cache. The client is part of the key, so a client is only served answers
+# it has paid for and the API costs stay with the client which incurred them.
+# Key: (client, model_name, temperature, normalized query). Value: (timestamp, content, citations)
+_response_cache = {}
+
+# Requests currently in flight, keyed as the response cache, so only within a client. Identical queries
+# issued concurrently by a client (e.g. the same company for several candidates) await the one request.
+_inflight_requests = {}
+
+# Cap on concurrent Perplexity calls. Keeping in-flight requests below the rate limit
+# avoids bursts of 429s which would all back off together and stall the fan-out.
+PERPLEXITY_CONCURRENCY = int(os.environ.get('PERPLEXITY_CONCURRENCY', 8))
+
+# Stream responses rather than waiting for the whole generation. Off by default, because streamed
+# responses may not report token usage, which then falls back to counting tokens locally.
+PERPLEXITY_STREAMING = os.environ.get('PERPLEXITY_STREAMING', 'false').lower() == 'true'
+
+# The system prompt for all searches
+PERPLEXITY_SYSTEM_PROMPT = "You are a helpful assistant with access to the internet."
+
+# Only transient HTTP failures are worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_retryable_error(exception):
+    """
+    Decide whether a failed Perplexity call should be retried.
+
+    Args:
+        exception (Exception): The exception raised by the call.
+
+    Returns:
+        bool: True if the exception carries a transient HTTP status code.
+    """
+    status_code = getattr(exception, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(exception, 'response', None), 'status_code', None)
+    return status_code in RETRYABLE_STATUS_CODES
 
 class PerplexityAgent(AgentBase):
     """
     Agent for performing searches using the Perplexity API.
+    Responses are cached per query, so repeated queries within the TTL skip the API call.
     """
-    
-    @retry(wait=wait_random_exponential(min=1, max=60), stop=stop_after_attempt(6))
-    async def run(self, search_query, temperature=0):
+    # Shared by all instances, so the cap holds across clients
+    _semaphore = asyncio.Semaphore(PERPLEXITY_CONCURRENCY)
+
+    def __init__(self, app):
+        """
+        Initialize the PerplexityAgent.
+
+        Args:
+            app: The main application instance.
+        """
+        super().__init__(app)
+        # Key: (model_name, temperature). Value: (ChatPerplexity, chain), reused across calls
+        self._ppx_cache = {}
+
+    def get_ppx_chain(self, model_name, temperature):
+        """
+        Get the Perplexity client and chain for this model and temperature, creating them on first use
+        so the HTTP client and its connections are reused between searches.
+
+        Args:
+            model_name (str): The Perplexity model name.
+            temperature (float): The temperature for the language model.
+
+        Returns:
+            tuple: (ChatPerplexity, chain)
+        """
+        cache_key = (model_name, temperature)
+        if cache_key not in self._ppx_cache:
+            ppx = ChatPerplexity(temperature=temperature, model=model_name)
+            self._ppx_cache[cache_key] = (ppx, self.build_chain(ppx, PERPLEXITY_SYSTEM_PROMPT))
+        return self._ppx_cache[cache_key]
+
+    def build_chain(self, llm, prompt_text):
+        """
+        Build the search chain, which sends the query as the human message.
+
+        Args:
+            llm (ChatPerplexity): The Perplexity model.
+            prompt_text (str): The system prompt.
+
+        Returns:
+            Runnable: The prompt and llm chain.
+        """
+        prompt = ChatPromptTemplate.from_messages([("system", prompt_text),
+                                                   ("human", "{input}")])
+        return prompt | llm
+
+    @staticmethod
+    def normalize_query(search_query):
+        """
+        Normalize a query for use as a cache key, so trivially different queries share an entry.
+
+        Args:
+            search_query (str): The query to normalize.
+
+        Returns:
+            str: The query in lower case with whitespace collapsed.
+        """
+        return " ".join(search_query.lower().split())
+
+    def get_cached_response(self, cache_key):
+        """
+        Get a cached response for the given key, if present and not expired.
+
+        Args:
+            cache_key (tuple): The (client, model_name, temperature, normalized query) key.
+
+        Returns:
+            tuple: (content, citations) if a fresh entry exists, otherwise None.
+        """
+        cached = _response_cache.get(cache_key)
+        if cached is None:
+            return None
+
+        timestamp, content, citations = cached
+        if time.time() - timestamp > RESPONSE_CACHE_TTL:
+            del _response_cache[cache_key]
+            return None
+
+        return content, citations
+
+    def get_token_usage(self, response, ppx, search_query, content):
+        """
+        Get the token usage reported by the API, only counting tokens locally if it's missing.
+
+        Args:
+            response: The AIMessage returned by the chain.
+            ppx (ChatPerplexity): The model, used for the local token count fallback.
+            search_query (str): The query sent.
+            content (str): The response content.
+
+        Returns:
+            tuple: (input_tokens, output_tokens)
+        """
+        try:
+            token_usage = response.response_metadata.get('token_usage') or response.additional_kwargs.get('usage')
+            if token_usage:
+                return token_usage['prompt_tokens'], token_usage['completion_tokens']
+
+            usage_metadata = getattr(response, 'usage_metadata', None)
+            if usage_metadata:
+                return usage_metadata['input_tokens'], usage_metadata['output_tokens']
+        except (AttributeError, KeyError, TypeError):
+            pass
+
+        return ppx.get_num_tokens(search_query), ppx.get_num_tokens(content)
+
+    @retry(retry=retry_if_exception(is_retryable_error), wait=wait_random_exponential(min=0.5, max=10),
+           stop=stop_after_attempt(4), reraise=True)
+    async def ainvoke_with_retry(self, chain, search_query):
+        """
+        Invoke the Perplexity chain, within the concurrency cap, retrying transient HTTP errors.
+        If PERPLEXITY_STREAMING is set, the response is streamed and merged into a single message.
+        The semaphore is released while backing off, so waiting retries don't block other calls.
+
+        Args:
+            chain: The prompt | ChatPerplexity chain.
+            search_query (str): The query to search for.
+
+        Returns:
+            AIMessage: The response from Perplexity.
+        """
+        async with self._semaphore:
+            if not PERPLEXITY_STREAMING:
+                return await chain.ainvoke({"input": search_query})
+
+            # Merge the chunks as they arrive, citations and metadata are merged into the final message
+            response = None
+            async for chunk in chain.astream({"input": search_query}):
+                response = chunk if response is None else response + chunk
+            return response
+
+    async def run(self, search_query, temperature=0, client=None):
         """
         Execute a search using the Perplexity API.
 
         Args:
             search_query (str): The query to search for.
             temperature (float, optional): The temperature for the language model. Defaults to 0.
+            client (str, optional): The client identifier, responses are only cached within a client.
 
         Returns:
             tuple: A tuple containing the search response content and consumption details.
         """
         try:
             model_name = "llama-3.1-sonar-small-128k-online"
-            ppx = ChatPerplexity(temperature=temperature, model=model_name)
-            prompt = ChatPromptTemplate.from_messages([("system", "You are a helpful assistant with access to the internet."), 
-                                                       ("human", "{input}")])
-            chain = prompt | ppx
-            response = await chain.ainvoke({"input": search_query})
-            
-            #citations = response.model_extra.get("citations")
-            #citations = response.additional_kwargs['citations']
-            #print(f"Perp citations: {response.additional_kwargs['citations']}")
+            ppx, chain = self.get_ppx_chain(model_name, temperature)
+
+            # Return the cached answer if this query was asked recently
+            cache_key = (client, model_name, temperature, self.normalize_query(search_query))
+            cached = self.get_cached_response(cache_key)
+
+            if cached is not None:
+                content, citations = cached
+                search_calls, input_tokens, output_tokens = 0, 0, 0
+            else:
+                # Join an identical request already in flight, rather than sending another
+                task = _inflight_requests.get(cache_key)
+                is_duplicate = task is not None
+                if not is_duplicate:
+                    task = asyncio.ensure_future(self.ainvoke_with_retry(chain, search_query))
+                    _inflight_requests[cache_key] = task
+                    task.add_done_callback(lambda _: _inflight_requests.pop(cache_key, None))
+
+                # shield, so one cancelled caller doesn't cancel the request for the others
+                response = await asyncio.shield(task)
+                
+                #citations = response.model_extra.get("citations")
+                #citations = response.additional_kwargs['citations']
+                #print(f"Perp citations: {response.additional_kwargs['citations']}")
+
+                # Extract citations directly from additional_kwargs
+                citations = response.additional_kwargs.get('citations', [])
+
+                # Extract content
+                content = response.content if hasattr(response, 'content') else str(response)
 
-            # Extract citations directly from additional_kwargs
-            citations = response.additional_kwargs.get('citations', [])
+                _response_cache[cache_key] = (time.time(), content, citations)
 
-            # Extract content
-            content = response.content if hasattr(response, 'content') else str(response)
+                # Only the caller which sent the request is charged for it, always the same client as the duplicates
+                if is_duplicate:
+                    search_calls, input_tokens, output_tokens = 0, 0, 0
+                else:
+                    search_calls = 1
+                    input_tokens, output_tokens = self.get_token_usage(response, ppx, search_query, content)
 
             # Format citations if they exist
             if citations:
                 citation_text = "\n".join(f"{index}, {url}" for index, url in enumerate(citations, start=1))
                 content = content + "\n\n" + citation_text
-                print(f"Citations: {citation_text}")
 
             # Log consumption
-            consumption = await self.log_consumption(
+            consumption = self.log_consumption(
                 function_name="perplexity_tool",
                 model=model_name,
-                search_calls=1,
-                input_tokens=ppx.get_num_tokens(search_query),
-                output_tokens=ppx.get_num_tokens(content)
+                search_calls=search_calls,
+                input_tokens=input_tokens,
+                output_tokens=output_tokens
             )
 
             return content, consumption
 
         except Exception as e:
             msg = f"An error occurred while executing perplexity_tool: {str(e)}"
-            await self.app.handle_error(self.app.logger, logging.ERROR, msg)
+            self.app.handle_error(self.app.logger, logging.ERROR, msg)
             return "", {
                 'function': 'perplexity_tool',
                 'model': 'perplexity_' + model_name,
@@ -2,12 +2,48 @@
 
 from agents.base import AgentBase
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import BaseModel, Field
 import logging
-import json
-import os
+from operator import itemgetter
+
+# Structured output for scoring novelty
+class NoveltyScore(BaseModel):
+    """Score novelty of recent search results vs previous results"""
+    novelty_score: int = Field(description="Score of how novel the new search results are (1-10)")
+    reasoning: str = Field(description="Explanation for the score given")
+
+# Map the params dict onto the prompt's variables
+PROMPT_INPUT = {
+    'first_name': itemgetter('first_name'),
+    'last_name': itemgetter('last_name'),
+    'company': itemgetter('company'),
+    'search_results': itemgetter('search_results'),
+    'search_results_previous': itemgetter('search_results_previous')
+}
 
 class ResultsComparisonAgent(AgentBase):
     """Agent for comparing search results and scoring novelty."""
+    # Compares live results against prior ones, so its output must never be reused
+    cacheable = False
+
+    def build_chain(self, llm, prompt_text):
+        """
+        Build the novelty scoring chain.
+
+        Args:
+            llm: The language model to use for scoring.
+            prompt_text (str): The results comparison prompt.
+
+        Returns:
+            Runnable: The prompt input, prompt and structured output llm chain.
+                      Returns a dict of 'raw' (the AIMessage), 'parsed' and 'parsing_error'.
+        """
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "You are a web researcher."),
+            ("human", prompt_text),
+        ]).partial()
+
+        return (PROMPT_INPUT | prompt | llm.with_structured_output(NoveltyScore, include_raw=True))
 
     async def run(self, llm, params, client):
         """
@@ -31,72 +67,29 @@ class ResultsComparisonAgent(AgentBase):
                 - consumption (Dict[str, Any]): Details of resource consumption.
         """
         try:
-            # Define the tool for scoring novelty
-            tools = [{
-                "name": "results_novelty_score",
-                "description": "Score novelty of recent search results vs previous results",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "novelty_score": {
-                            "type": "integer",
-                            "description": "Score of how novel the new search results are (1-10)"
-                        },
-                        "reasoning": {
-                            "type": "string",
-                            "description": "Explanation for the score given"
-                        }
-                    },
-                    "required": ["novelty_score", "reasoning"]
-                }
-            }]
-
-            # Define the prompt template
-            prompt_text = self.prompt_from_file('prompt_resultscomparisonagent.txt', client=client)
-
-            # Create the prompt using ChatPromptTemplate
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", "You are a web researcher."),
-                ("human", prompt_text),
-            ]).partial()
-
-            # Create the chain to invoke the language model
-            prompt_input = {
-                'first_name': lambda x: x['first_name'],
-                'last_name': lambda x: x['last_name'],
-                'company': lambda x: x['company'],
-                'search_results': lambda x: x['search_results'],
-                'search_results_previous': lambda x: x['search_results_previous']
-            }
-            chain = (prompt_input | prompt | llm.bind_tools(tools, tool_choice="results_novelty_score"))
+            # Get the chain to invoke the language model
+            chain = await self.get_chain(llm, client, 'prompt_resultscomparisonagent.txt')
 
             # Invoke the chain asynchronously
             response = await chain.ainvoke(params)
 
-            # Extract function arguments from the response
-            func_args = response.additional_kwargs['tool_calls'][0]['function']['arguments']
-
-            # Extract the novelty score and reasoning from the JSON response
-            try:
-                func_args_data = json.loads(func_args)
-                novelty_score = int(func_args_data['novelty_score'])
-                reasoning = func_args_data['reasoning']
-            except json.JSONDecodeError:
-                msg = "Results_Comparison_Agent: Error: Invalid JSON"
-                await self.app.handle_error(self.app.logger, logging.ERROR, msg)
-                novelty_score, reasoning = -1, "Error: Invalid JSON"
-            except KeyError as e:
-                msg = f"Results_Comparison_Agent: Error: Missing key in JSON: {str(e)}"
-                await self.app.handle_error(self.app.logger, logging.ERROR, msg)
-                novelty_score, reasoning = -1, f"Error: Missing key in JSON: {str(e)}"
+            # The raw message carries the token usage, parsed is a NoveltyScore
+            raw_response, result = response['raw'], response['parsed']
+
+            if result is not None:
+                novelty_score, reasoning = result.novelty_score, result.reasoning
+            else:
+                msg = f"Results_Comparison_Agent: Error: Invalid structured output: {response['parsing_error']}"
+                self.app.handle_error(self.app.logger, logging.ERROR, msg)
+                novelty_score, reasoning = -1, "Error: Invalid structured output"
 
             # Log the consumption
-            consumption = await self.log_consumption(
+            consumption = self.log_consumption(
                 function_name='results_comparison_agent',
-                model=response.response_metadata['model_name'],
+                model=raw_response.response_metadata['model_name'],
                 search_calls=0,
-                input_tokens=response.response_metadata['token_usage']['prompt_tokens'],
-                output_tokens=response.response_metadata['token_usage']['completion_tokens']
+                input_tokens=raw_response.response_metadata['token_usage']['prompt_tokens'],
+                output_tokens=raw_response.response_metadata['token_usage']['completion_tokens']
             )
 
             # Return the novelty score, reasoning, and consumption
@@ -104,7 +97,7 @@ class ResultsComparisonAgent(AgentBase):
 
         except Exception as e:
             msg = f"An error occurred while executing results_comparison_agent: {str(e)}"
-            await self.app.handle_error(self.app.logger, logging.ERROR, msg)
+            self.app.handle_error(self.app.logger, logging.ERROR, msg)
             return -1, "Error occurred during execution", {
                 'function': 'results_comparison_agent',
                 'model': 'unknown',
@@ -2,14 +2,77 @@
 
 from agents.base import AgentBase
 from langchain_core.prompts import ChatPromptTemplate
-import os
-import json
+from langchain_core.pydantic_v1 import BaseModel, Field
+import orjson
+import hashlib
 import logging
+from operator import itemgetter
+
+# Max entries in the score cache, the oldest are evicted first
+SCORE_CACHE_MAX_ENTRIES = 1024
+
+# Process-wide cache of scores, so identical inputs (e.g. a rerun, or leads whose searches returned
+# the same text) skip the LLM call. Key: (model_name, hash of prompt and params).
+# Value: (activity_score, services_need_score, summary, model)
+_score_cache = {}
+
+# Structured output for scoring
+class ScoreBusiness(BaseModel):
+    """Score of business text for services production need, as per metrics"""
+    reasoning: str = Field(description="Explanation for the score given the metrics")
+    services_need_score: int = Field(ge=0, le=10, description="Score of the text to inform services production needs, as per metrics (0-10)")
+    summary_of_facts: str = Field(description="List of facts in the text which led to the score, not mentioning metrics")
+
+# Map the params dict onto the prompt's variables
+PROMPT_INPUT = {
+    'first_name': itemgetter('first_name'),
+    'last_name': itemgetter('last_name'),
+    'company': itemgetter('company'),
+    'search_period': itemgetter('search_period'),
+    'details': itemgetter('details')
+}
 
 class TargetScoreAgent(AgentBase):
     """
     Agent responsible for analyzing business activity and services needs.
+    Scores are cached on the exact prompt and inputs, so repeated inputs skip the LLM call.
     """
+    @staticmethod
+    def make_cache_key(llm, prompt_text, params):
+        """
+        Build the score cache key for a call.
+
+        Args:
+            llm: The language model to use for scoring.
+            prompt_text (str): The target score prompt.
+            params (dict): The prompt's inputs.
+
+        Returns:
+            tuple: (model_name, hex digest of the prompt and inputs)
+        """
+        key_parts = [prompt_text] + [str(params[k]) for k in ('first_name', 'last_name', 'company', 'search_period', 'details')]
+        digest = hashlib.sha256(orjson.dumps(key_parts)).hexdigest()
+        return getattr(llm, 'model_name', type(llm).__name__), digest
+
+    def build_chain(self, llm, prompt_text):
+        """
+        Build the target scoring chain.
+
+        Args:
+            llm: The language model to use for scoring.
+            prompt_text (str): The target score prompt.
+
+        Returns:
+            Runnable: The prompt input, prompt and structured output llm chain.
+                      Returns a dict of 'raw' (the AIMessage), 'parsed' and 'parsing_error'.
+        """
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "You score results of web searches according to a strict set of metrics"),
+            ("human", prompt_text),
+        ]).partial()
+
+        return (PROMPT_INPUT | prompt | llm.with_structured_output(ScoreBusiness, include_raw=True))
+
     async def run(self, llm, params, client):
         """
         Analyze business activity and services needs based on provided text.
@@ -24,83 +87,57 @@ class TargetScoreAgent(AgentBase):
         """
         try:
 
-            # Define the prompt template
-            prompt_text = self.prompt_from_file('prompt_targetscoreagent.txt', client=client)
-
-            # Define tools for scoring
-            tools = [{
-                "name": "score_business",
-                "description": "Score of business text for services production need, as per metrics",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "reasoning": {
-                            "type": "string",
-                            "description": "Explanation for the score given the metrics"
-                        },                        
-                        "services_need_score": {
-                            "type": "integer",
-                            "description": "Score of the text to inform services production needs, as per metrics (0-10)"
-                        },
-                        "summary_of_facts": {
-                            "type": "string",
-                            "description": "List of facts in the text which led to the score, not mentioning metrics"
-                        }
-                    },
-                    "required": ["reasoning", "services_need_score", "summary_of_facts"]
-                }
-            }]
-
-            # Create the prompt using ChatPromptTemplate
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", "You score results of web searches according to a strict set of metrics"),
-                ("human", prompt_text),
-            ]).partial()
-
-            # Create the chain to invoke the language model
-            prompt_input = {
-                'first_name': lambda x: x['first_name'],
-                'last_name': lambda x: x['last_name'],
-                'company': lambda x: x['company'],
-                'search_period': lambda x: x['search_period'],
-                'details': lambda x: x['details']
-            }
-
-            # Create the chain to invoke the language model
-            chain = (prompt_input | prompt | llm.bind_tools(tools, tool_choice="score_business"))
-
-
-            # Debug
-            # print(f"prompt_input: {prompt_input}")
+            # Get the prompt, for the cache key
+            prompt_text = await self.aprompt_from_file('prompt_targetscoreagent.txt', client=client)
+
+            # Return the cached scores if these exact inputs were scored before
+            cache_key = self.make_cache_key(llm, prompt_text, params)
+            cached = _score_cache.get(cache_key)
+            if cached is not None:
+                activity_score, services_need_score, summary, model = cached
+                consumption = self.log_consumption(
+                    function_name='target_score_agent',
+                    model=model,
+                    search_calls=0,
+                    input_tokens=0,
+                    output_tokens=0
+                )
+                return activity_score, services_need_score, summary, consumption
+
+            # Get the chain, built once per llm and prompt
+            chain = await self.get_chain(llm, client, 'prompt_targetscoreagent.txt')
 
             # Invoke the chain asynchronously
             response = await chain.ainvoke(params)
 
-            # Extract function arguments from the response
-            func_args = response.additional_kwargs['tool_calls'][0]['function']['arguments']
+            # The raw message carries the token usage, parsed is a ScoreBusiness
+            raw_response = response['raw']
+
+            # Defaults, returned if the scores can't be extracted
+            activity_score, services_need_score, summary = 0, 0, ""
 
-            # Extract the scores from the JSON response
             try:
-                func_args_data = json.loads(func_args)
-                activity_score = 0 #int(func_args_data['activity_score'])
-                services_need_score = int(func_args_data['services_need_score'])
-                reasoning = func_args_data['reasoning']
-                summary = func_args_data['summary_of_facts']
-
-            except json.JSONDecodeError:
-                msg = "Results_Merging_agent, Error: Invalid JSON"
-                await self.app.handle_error(self.app.logger, logging.ERROR, msg)
-            except KeyError as e:
-                msg = f"Results_Merging_Agent, Error: Missing key in JSON: {str(e)}"
-                await self.app.handle_error(self.app.logger, logging.ERROR, msg)
+                result = self.parse_structured_response(response, ScoreBusiness)
+                activity_score = 0  # no longer scored, kept for the return signature
+                services_need_score = result.services_need_score
+                summary = result.summary_of_facts
+
+                # Cache the scores, evicting the oldest entry when full
+                if len(_score_cache) >= SCORE_CACHE_MAX_ENTRIES:
+                    _score_cache.pop(next(iter(_score_cache)))
+                _score_cache[cache_key] = (activity_score, services_need_score, summary, raw_response.response_metadata['model_name'])
+
+            except ValueError as e:
+                msg = f"target_score_agent, Error: Invalid structured output: {str(e)}"
+                self.app.handle_error(self.app.logger, logging.ERROR, msg)
 
             # Log the consumption
-            consumption = await self.log_consumption(
+            consumption = self.log_consumption(
                 function_name='target_score_agent',
-                model=response.response_metadata['model_name'],
+                model=raw_response.response_metadata['model_name'],
                 search_calls=0,
-                input_tokens=response.response_metadata['token_usage']['prompt_tokens'],
-                output_tokens=response.response_metadata['token_usage']['completion_tokens']
+                input_tokens=raw_response.response_metadata['token_usage']['prompt_tokens'],
+                output_tokens=raw_response.response_metadata['token_usage']['completion_tokens']
             )
 
             # Return the extracted scores and summary. 
@@ -109,7 +146,7 @@ class TargetScoreAgent(AgentBase):
 
         except Exception as e:
             msg = f"target_score_agent, An error occurred while executing: {str(e)}"
-            await self.app.handle_error(self.app.logger, logging.ERROR, msg)
+            self.app.handle_error(self.app.logger, logging.ERROR, msg)
             return 0, 0, "", {
                 'function': 'target_score_agent',
                 'model': 'unknown',
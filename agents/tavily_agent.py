@@ -1,36 +1,106 @@
 """Agent for performing searches using the Tavily API."""
 
-from langchain_community.tools.tavily_search import TavilySearchResults
-from agents.base import AgentBase
-import asyncio
+from agents.base import ToolBase
+import time
 import logging
+import orjson
 
-class TavilyAgent(AgentBase):
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+
+# Tavily searches can take several seconds, longer than the HTTP client's default timeout
+TAVILY_TIMEOUT_SECONDS = 15
+
+# The search depth the langchain TavilySearchResults tool sent by default, the API itself defaults to basic
+TAVILY_SEARCH_DEPTH = "advanced"
+
+# Search results go stale, so expire cached responses after a day
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+
+# Process-wide response cache. The client is part of the key, so a client is only served results
+# it has paid for and the API costs stay with the client which incurred them.
+# Key: (client, max_results, normalized query). Value: (timestamp, response)
+_response_cache = {}
+
+# Separates the results in the text sent on to the agents
+RESULT_SEPARATOR = "-" * 50 + "\n"
+
+class TavilyAgent(ToolBase):
     """
     Agent for performing searches using the Tavily API.
+    Calls the HTTP API directly over the app's shared HTTP client, so searches don't each occupy a worker thread.
+    Responses are cached per query, so repeated queries within the TTL skip the API call.
     """
+    def get_cached_response(self, cache_key):
+        """
+        Get a cached response for the given key, if present and not expired.
+
+        Args:
+            cache_key (tuple): The (client, max_results, normalized query) key.
+
+        Returns:
+            list: The cached response if a fresh entry exists, otherwise None.
+        """
+        cached = _response_cache.get(cache_key)
+        if cached is None:
+            return None
+
+        timestamp, response = cached
+        if time.time() - timestamp > RESPONSE_CACHE_TTL:
+            del _response_cache[cache_key]
+            return None
+
+        return response
 
     async def run(self, search_query, config, **kwargs):
         """
-        Execute a search using the Tavily search tool and return the results along with consumption details.
+        Execute a search using the Tavily search API and return the results along with consumption details.
         
         Args:
             search_query (str): The query to search for.
-            config (dict): Configuration containing max searches and other settings.
-            **kwargs: Additional parameters passed to the Tavily search tool.
+            config (dict): Configuration containing API key, max searches and other settings.
+            **kwargs: Additional parameters passed to the Tavily search API.
 
         Returns:
             tuple: A tuple containing the search response and consumption details.
+                   The response is a list of dicts with 'url' and 'content' keys.
         """
         try:
-            # Create Tavily search tool instance
-            search_tool = TavilySearchResults(max_results=config['MAX_TAVILY_SEARCHES'], include_images=False)
-            
-            # Execute the search asynchronously
-            response = await asyncio.to_thread(search_tool, search_query, **kwargs)
+            # Return the cached results if this query was searched recently. Calls with extra
+            # API parameters aren't cached, as they may change the results.
+            cache_key = (config['CLIENT'], config['MAX_TAVILY_SEARCHES'], " ".join(search_query.lower().split()))
+            cached = None if kwargs else self.get_cached_response(cache_key)
+            if cached is not None:
+                consumption = self.log_consumption(
+                    function_name='tavily_tool',
+                    model='tavily',
+                    search_calls=0,
+                    input_tokens=0,
+                    output_tokens=0
+                )
+                return list(cached), consumption
+
+            payload = {
+                "api_key": config['TAVILY_API_KEY'],
+                "query": search_query,
+                "max_results": config['MAX_TAVILY_SEARCHES'],
+                "search_depth": TAVILY_SEARCH_DEPTH,
+                "include_images": False,
+                **kwargs
+            }
+
+            # Execute the search over the shared client
+            resp = await self.app.http_client.post(TAVILY_SEARCH_URL, json=payload, timeout=TAVILY_TIMEOUT_SECONDS)
+            resp.raise_for_status()
+            data = orjson.loads(resp.content)
+
+            # Keep the same fields as the langchain TavilySearchResults tool returned
+            response = [{"url": item.get("url"), "content": item.get("content")} for item in data.get("results", [])]
+
+            if not kwargs:
+                _response_cache[cache_key] = (time.time(), list(response))
 
             # Log the consumption
-            consumption = await self.log_consumption(
+            consumption = self.log_consumption(
                 function_name='tavily_tool',
                 model='tavily',
                 search_calls=len(response),
@@ -42,7 +112,7 @@ class TavilyAgent(AgentBase):
 
         except Exception as e:
             msg = f"An error occurred while executing tavily_tool: {str(e)}"
-            await self.app.handle_error(self.app.logger, logging.ERROR, msg)
+            self.app.handle_error(self.app.logger, logging.ERROR, msg)
             return [], {
                 'function': 'tavily_tool',
                 'model': 'tavily',
@@ -64,17 +134,13 @@ class TavilyAgent(AgentBase):
         if not isinstance(dict_list, list) or not dict_list:
             return "No search results available."
         
-        formatted_text = ""
-        valid_results = False
-        
+        parts = []
+
         try:
             for item in dict_list:
                 if isinstance(item, dict) and 'url' in item and 'content' in item:
-                    formatted_text += f"URL: {item['url']}\n"
-                    formatted_text += f"Content: {item['content']}\n"
-                    formatted_text += "-" * 50 + "\n"
-                    valid_results = True
-            
-            return formatted_text if valid_results else "No search results available."
-        except:
-            return "No search results available."
\ No newline at end of file
+                    parts.append(f"URL: {item['url']}\nContent: {item['content']}\n{RESULT_SEPARATOR}")
+
+            return "".join(parts) if parts else "No search results available."
+        except (TypeError, KeyError):
+            return "No search results available."
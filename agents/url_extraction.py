@@ -2,17 +2,132 @@
 URL Extraction Agent for extracting relevant URLs from search results.
 """
 
-import os
-import json
+import re
 import logging
-from typing import Dict, Any, Tuple
+from operator import itemgetter
 from langchain.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import BaseModel, Field
 from agents.base import AgentBase
 
+# Any http(s) URL. Search results without one give the LLM nothing to extract
+URL_RE = re.compile(r'https?://[^\s"\'<>)\]]+', re.IGNORECASE)
+
+# Facebook pages and LinkedIn member profiles, capturing the page name or profile slug
+FACEBOOK_RE = re.compile(r'https?://(?:[\w-]+\.)?facebook\.com/([\w.-]+)', re.IGNORECASE)
+LINKEDIN_RE = re.compile(r'https?://(?:[\w-]+\.)?linkedin\.com/in/([\w-]+)', re.IGNORECASE)
+
+# Alphanumeric words, for matching names against URL slugs and domains on whole words
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Domains which are never a company's own website
+NON_COMPANY_DOMAINS = ('facebook.com', 'linkedin.com', 'twitter.com', 'x.com', 'instagram.com', 'youtube.com',
+                       'wikipedia.org', 'google.com', 'crunchbase.com', 'companieshouse.gov.uk', 'perplexity.ai')
+
+# Words in company names too generic to identify a domain
+COMPANY_STOPWORDS = {'ltd', 'limited', 'inc', 'llc', 'llp', 'plc', 'the', 'and', 'group', 'company', 'co', 'uk'}
+
+# Structured output for URL extraction
+class ExtractUrls(BaseModel):
+    """Extracts Facebook, LinkedIn and company URLs from a text."""
+    url_facebook: str = Field(description="The Facebook profile URL of the organization, e.g. https://www.facebook.com/anicca")
+    url_linkedin: str = Field(description="The LinkedIn profile URL of the individual, e.g. https://www.linkedin.com/in/annstanley")
+    url_company: str = Field(description="The company website URL, e.g. https://www.anicca.co.uk")
+
+# Map the params dict onto the prompt's variables
+PROMPT_INPUT = {
+    'first_name': itemgetter('first_name'),
+    'last_name': itemgetter('last_name'),
+    'company': itemgetter('company'),
+    'search_raw': itemgetter('search_raw')
+}
+
 class URLextractionAgent(AgentBase):
     """
     Agent responsible for merging and processing search results.
     """
+    @staticmethod
+    def try_extract_urls_without_llm(search_raw, first_name, last_name, company):
+        """
+        Extract the URLs deterministically, when the search results leave no doubt.
+        Each URL must have exactly one candidate in the text matching the person or company:
+        a LinkedIn profile whose slug contains both the first and last name as whole words (or joined),
+        a Facebook page and a website domain which contain a whole word of the company name,
+        or the whole company name run together.
+
+        Args:
+            search_raw (str): The raw search results.
+            first_name (str): The first name of the person.
+            last_name (str): The last name of the person.
+            company (str): The company associated with the person.
+
+        Returns:
+            Optional[Tuple[str, str, str]]: (url_facebook, url_linkedin, url_company), or None if any is ambiguous or missing.
+        """
+        urls = {url.rstrip('.,;:') for url in URL_RE.findall(search_raw)}
+        first_name_key = ''.join(TOKEN_RE.findall(first_name.lower()))
+        last_name_key = ''.join(TOKEN_RE.findall(last_name.lower()))
+        company_keys = {word for word in TOKEN_RE.findall(company.lower())
+                        if len(word) > 2 and word not in COMPANY_STOPWORDS}
+        if not urls or not first_name_key or not last_name_key or not company_keys:
+            return None
+        full_name_keys = {first_name_key + last_name_key, last_name_key + first_name_key}
+        company_slug = ''.join(word for word in TOKEN_RE.findall(company.lower()) if word not in COMPANY_STOPWORDS)
+
+        def matches_company(name):
+            tokens = TOKEN_RE.findall(name)
+            return ''.join(tokens) == company_slug or not company_keys.isdisjoint(tokens)
+
+        linkedin, facebook, websites = set(), set(), set()
+        for url in urls:
+            match = LINKEDIN_RE.match(url)
+            if match:
+                slug = match.group(1).lower()
+                tokens = TOKEN_RE.findall(slug)
+                if ((first_name_key in tokens and last_name_key in tokens)
+                        or not full_name_keys.isdisjoint(tokens)):
+                    linkedin.add(f"https://www.linkedin.com/in/{slug}")
+                continue
+
+            match = FACEBOOK_RE.match(url)
+            if match:
+                page = match.group(1).lower()
+                if matches_company(page):
+                    facebook.add(f"https://www.facebook.com/{page}")
+                continue
+
+            scheme, _, rest = url.partition('://')
+            domain = rest.split('/', 1)[0].lower()
+            if domain.startswith('www.'):
+                domain = domain[4:]
+            # Match whole labels, so 'x.com' excludes x.com and its subdomains but not fedex.com
+            if any(domain == excluded or domain.endswith('.' + excluded) for excluded in NON_COMPANY_DOMAINS):
+                continue
+            if matches_company(domain.split('.', 1)[0]):
+                websites.add(f"https://www.{domain}")
+
+        if len(linkedin) == 1 and len(facebook) == 1 and len(websites) == 1:
+            return facebook.pop(), linkedin.pop(), websites.pop()
+        return None
+
+    def build_chain(self, llm, prompt_text):
+        """
+        Build the URL extraction chain.
+
+        Args:
+            llm: The language model to use for processing.
+            prompt_text (str): The URL extraction prompt.
+
+        Returns:
+            Runnable: The prompt input, prompt and structured output llm chain.
+                      Returns a dict of 'raw' (the AIMessage), 'parsed' and 'parsing_error'.
+        """
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "You extract company and personal urls from urls in a text."),
+            ("human", prompt_text),
+        ]).partial()
+
+        return (PROMPT_INPUT | prompt | llm.with_structured_output(ExtractUrls, include_raw=True))
+
     async def run(self, llm, params, client):
         """
         Merge and process search results for a given query and extract relevant information.
@@ -34,83 +149,56 @@ class URLextractionAgent(AgentBase):
         url_linkedin = ""
         url_company  = ""
 
-        tools = [{
-                "name": "extract_urls",
-                "description": "Extracts Facebook, LinkedIn and company URLs from a text.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                    "url_facebook": {
-                        "type": "string",
-                        "description": "The Facebook profile URL of the organization.",
-                        "example": "https://www.facebook.com/anicca"
-                    },
-                    "url_linkedin": {
-                        "type": "string",
-                        "description": "The LinkedIn profile URL of the individual.",
-                        "example": "https://www.linkedin.com/in/annstanley"
-                    },
-                    "url_company": {
-                        "type": "string",
-                        "description": "The company website URL.",
-                        "example": "https://www.anicca.co.uk"
-                    }
-                    },
-                    "required": ["url_facebook", "url_linkedin", "url_company"]
-                }
-                }]
-
         try:
-            # Define the prompt template
-            prompt_text = self.prompt_from_file('prompt_urlextractionagent.txt', client=client)
-
-            # Create the prompt using ChatPromptTemplate
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", "You extract company and personal urls from urls in a text."),
-                ("human", prompt_text),
-            ]).partial()
-
-            prompt_input = {
-                'first_name': lambda x: x['first_name'],
-                'last_name': lambda x: x['last_name'],
-                'company': lambda x: x['company'],
-                'search_raw': lambda x: x['search_raw']
-            }
-
-            # Create the chain to invoke the language model
-            chain = (prompt_input | prompt | llm.bind_tools(tools, tool_choice="extract_urls"))
+            # The prompt only allows URLs evidenced in the text, so skip the LLM if there are none
+            if not URL_RE.search(params['search_raw']):
+                consumption = self.log_consumption(
+                    function_name='URLextractionAgent',
+                    model=getattr(llm, 'model_name', 'none'),
+                    search_calls=0,
+                    input_tokens=0,
+                    output_tokens=0
+                )
+                return url_facebook, url_linkedin, url_company, consumption
+
+            # Skip the LLM if each URL can be read unambiguously from the text
+            extracted = self.try_extract_urls_without_llm(params['search_raw'], params['first_name'],
+                                                          params['last_name'], params['company'])
+            if extracted is not None:
+                url_facebook, url_linkedin, url_company = extracted
+                consumption = self.log_consumption(
+                    function_name='URLextractionAgent',
+                    model=getattr(llm, 'model_name', 'none'),
+                    search_calls=0,
+                    input_tokens=0,
+                    output_tokens=0
+                )
+                return url_facebook, url_linkedin, url_company, consumption
+
+            # Get the chain, built once per llm and prompt
+            chain = await self.get_chain(llm, client, 'prompt_urlextractionagent.txt')
 
             # Invoke the chain asynchronously
             response = await chain.ainvoke(params)
 
-            # Extract function arguments from the response
-            func_args = response.additional_kwargs['tool_calls'][0]['function']['arguments']
+            # The raw message carries the token usage, parsed is an ExtractUrls
+            raw_response = response['raw']
 
-            # Extract the scores from the JSON response
             try:
+                result = self.parse_structured_response(response, ExtractUrls)
+                url_facebook, url_linkedin, url_company = result.url_facebook, result.url_linkedin, result.url_company
 
-                # Test if the response is a string that needs to be evaluated as a JSON object
-                func_args_data = json.loads(func_args) if isinstance(func_args, str) else func_args
-
-                url_facebook = func_args_data['url_facebook']
-                url_linkedin = func_args_data['url_linkedin']
-                url_company  = func_args_data['url_company']
-
-            except json.JSONDecodeError:
-                msg = "URLextractionAgent, Error: Invalid JSON string received."
-                self.app.handle_error(self.app.logger, logging.ERROR, msg)
-
-            except KeyError as e:
-                msg = f"URLextractionAgent, Error: Missing key in JSON: {str(e)}"
+            except ValueError as e:
+                msg = f"URLextractionAgent, Error: Invalid structured output: {str(e)}"
                 self.app.handle_error(self.app.logger, logging.ERROR, msg)
 
             # Log the consumption
-            consumption = await self.log_consumption(
+            consumption = self.log_consumption(
                 function_name='URLextractionAgent',
-                model=response.response_metadata['model_name'],
+                model=raw_response.response_metadata['model_name'],
                 search_calls=0,
-                input_tokens=response.response_metadata['token_usage']['prompt_tokens'],
-                output_tokens=response.response_metadata['token_usage']['completion_tokens']
+                input_tokens=raw_response.response_metadata['token_usage']['prompt_tokens'],
+                output_tokens=raw_response.response_metadata['token_usage']['completion_tokens']
             )
             # Return the extracted scores and summary. 
             # Reasoning is deprecated, used only to assist LLM reach the score.
@@ -5,20 +5,80 @@
 from core.storage_manager import StorageManager
 from core.client_manager import ClientManager
 from core.data_manager import DataManager  # For data handling
-from config.logger_config import LoggerConfig, NewFileForEachRunHandler, ErrorAction
+from config.logger_config import LoggerConfig, NewFileForEachRunHandler, BufferedRunFileHandler, ErrorAction
 
 import logging
+from logging.handlers import QueueHandler, QueueListener # For logging off the request path
+import queue
+import threading # For stopping the log listener once
+import atexit # For flushing buffered log records on shutdown
 import os
 import sys
-import inspect # For getting the calling frame
 import asyncio # For async ops
+import httpx # Shared HTTP client for outbound API calls
 from aiolimiter import AsyncLimiter # For rate limiting
 import yaml  # For config file reading
+try:
+    from yaml import CSafeLoader as YamlLoader  # libyaml's C parser, if available
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 import pandas as pd  # For DataFrame handling
 from datetime import datetime  # For date handling in pricing
 from pathlib import Path  # For path handling
 from dotenv import load_dotenv # For loading environment variables
 import traceback
+import functools # For wrapping timed methods
+import time # For timing methods
+
+def timing_decorator(logger_attr='logger'):
+    """
+    A DECORATOR factory for WebResearchApp methods, sync or async. Logs the start of the decorated
+    method and its total execution time. If an exception occurs, it logs the error and the time
+    at which the method failed.
+
+    Args:
+        logger_attr (str): The name of the instance attribute holding the logger.
+
+    Returns:
+        Callable: A decorator wrapping the method with timing and logging capabilities.
+
+    Raises:
+        Exception: Any exception raised by the decorated method is re-raised
+                   after logging.
+    """
+    def decorator(func):
+        def log_failure(self, start_time, e):
+            msg = f"{func.__name__} failed after {time.perf_counter() - start_time:.2f} seconds with error: {str(e)}"
+            self.handle_error(getattr(self, logger_attr), logging.CRITICAL, msg)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(self, *args, **kwargs):
+                logger = getattr(self, logger_attr)
+                start_time = time.perf_counter()
+                logger.info(f"Starting {func.__name__}...")
+                try:
+                    result = await func(self, *args, **kwargs)
+                except Exception as e:
+                    log_failure(self, start_time, e)
+                    raise
+                logger.info(f"{func.__name__} completed in {time.perf_counter() - start_time:.2f} seconds")
+                return result
+        else:
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                logger = getattr(self, logger_attr)
+                start_time = time.perf_counter()
+                logger.info(f"Starting {func.__name__}...")
+                try:
+                    result = func(self, *args, **kwargs)
+                except Exception as e:
+                    log_failure(self, start_time, e)
+                    raise
+                logger.info(f"{func.__name__} completed in {time.perf_counter() - start_time:.2f} seconds")
+                return result
+        return wrapper
+    return decorator
 
 class WebResearchApp:
 
@@ -36,15 +96,17 @@ class WebResearchApp:
         config (dict): Application configuration loaded from YAML file.
         client_managers (List[ClientManager]): List of client manager instances.
         df_prices (pd.DataFrame): DataFrame containing API pricing data.
+        http_client (httpx.AsyncClient): HTTP client shared by all outbound API calls.
 
     Methods:
         setup_logging(): Set up and configure the logging system.
+        stop_logging(): Flush log records to file and stop the log listener.
         handle_error(): Handle errors based on their severity level.
         read_config_app(): Read and validate configuration from a YAML file.
         create_client_managers(): Create ClientManager instances for each valid client directory.
+        read_subscriptions(): Read the subscriptions file.
         load_pricing_data(): Load pricing data from an Excel file.
         check_pricing_sequentiality(): Check the sequentiality of pricing data.
-        get_price(): Get the applicable price for a given model, date, and price type.
         calculate_api_costs(): Calculate API costs based on consumption data.
         run(): Main execution method for the WebResearchApp.
 
@@ -79,10 +141,17 @@ class WebResearchApp:
 
         # setup LLM prices
         self.df_prices = None
+        self.pricing_models = frozenset()
 
         # get today's date
         self.today = datetime.now()
 
+        # one HTTP/2 client shared by all outbound LLM and search calls, so connections are reused
+        self.http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=256, max_keepalive_connections=64)
+        )
+
         #self.client_managers = []
 
     # create log file
@@ -93,7 +162,9 @@ class WebResearchApp:
         This method creates a logger with the following characteristics:
         - Logger name: "app"
         - Log level: DEBUG (captures all log levels)
-        - Handler: NewFileForEachRunHandler (creates a new log file for each run)
+        - Handler: QueueHandler, whose records are written by a QueueListener thread
+          to a NewFileForEachRunHandler (creates a new log file for each run),
+          buffered so records are appended in batches and ERROR or above flushes at once
         - Log format: timestamp - logger name - log level - message
 
         Returns:
@@ -113,11 +184,36 @@ class WebResearchApp:
         
         formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         file_handler.setFormatter(formatter)
-        
-        logger.addHandler(file_handler)
+
+        # Batch records into block-sized appends, flushing immediately on ERROR and CRITICAL
+        self.log_buffer = BufferedRunFileHandler(target=file_handler, capacity=1024, flushLevel=logging.ERROR)
+        atexit.register(self.log_buffer.flush)
+
+        # Logging calls only enqueue the record, the listener's thread does the formatting and file writes
+        self._log_queue = queue.Queue(-1)
+        logger.addHandler(QueueHandler(self._log_queue))
+        self.log_listener = QueueListener(self._log_queue, self.log_buffer, respect_handler_level=True)
+        self.log_listener.start()
+        self._log_stop_lock = threading.Lock()
     
         return logger
 
+    def stop_logging(self):
+        """
+        Flush queued and buffered log records to file and stop the listener's thread.
+        Safe to call more than once, later calls only flush the buffer.
+        """
+        with self._log_stop_lock:
+            listener, self.log_listener = self.log_listener, None
+
+        if listener is not None:
+            try:
+                listener.stop()
+            except RuntimeError:
+                # Called from the listener's own thread (an error while writing the log), which can't join itself
+                pass
+        self.log_buffer.flush()
+
     def handle_error(self, error_level, message, exception=None):
         """
         Handle errors based on their severity level and configured actions.
@@ -137,9 +233,9 @@ class WebResearchApp:
             - Logs the error message and context.
             - May retry the operation or terminate the application based on the error level.
         """
-        # Get the calling frame (which function/object submitted the logged item)
-
-        frame = inspect.currentframe().f_back
+        # Get the calling frame (which function/object submitted the logged item),
+        # sys._getframe avoids the overhead of the inspect module
+        frame = sys._getframe(1)
         func_name = frame.f_code.co_name
         file_name = frame.f_code.co_filename
         line_no = frame.f_lineno
@@ -161,6 +257,8 @@ class WebResearchApp:
             self.retry_operation(self.logger, error_level, full_message, exception)
         elif action == ErrorAction.TERMINATE:
             self.logger.critical(f"{context_message}\nApplication is terminating due to critical error.")
+            # Write out the queued and buffered records, including this one, before exiting
+            self.stop_logging()
             sys.exit(1)
 
     def retry_operation(self, loggerconfig, logger, error_level, message, exception):
@@ -213,7 +311,7 @@ class WebResearchApp:
         config_content = self.storage_manager.read_file(config_file_path)
         
         try:
-            config = yaml.safe_load(config_content)
+            config = yaml.load(config_content, Loader=YamlLoader)
         except yaml.YAMLError as e:
             self.handle_error(self.logger, logging.CRITICAL, f"Error parsing YAML configuration file for {config_file_path}: {str(e)}")
             return config
@@ -247,87 +345,73 @@ class WebResearchApp:
 
         return config
 
-    def create_client_managers(self, subscriptions_file):
+    def read_subscriptions(self, subscriptions_file):
         """
-        Create tasks for active clients based on the subscriptions file. No active subscription means no tasks.
+        Read the subscriptions file.
 
         Args:
             subscriptions_file (str): Path to the subscriptions Excel file.
 
         Returns:
-            List[Dict[str, str]]: A list of dictionaries containing client information and folder paths.
+            pandas.DataFrame or None: The subscriptions, or None if the file could not be read or is empty.
         """
-        
         try:
             subscriptions_df = self.storage_manager.read_excel(subscriptions_file)
             # print("read subscriptions file")
         except Exception as e:
             # print(""couldnt read subscriptions file: {e}")
             self.handle_error(self.logger, logging.CRITICAL,f"Error reading subscriptions file: {str(e)}")
-            return []
+            return None
         
         if subscriptions_df.empty:
             # print("subs is empty")
             self.handle_error(self.logger, logging.CRITICAL,f"No data found in subscriptions file")
-            return []
-        
-        today = self.today.date()
-        # print("'Today is {today}')
-
-        for _, row in subscriptions_df.iterrows():
-            client = row.get('client')
-            # print("'Client is {client}')
-            if not client:
-                self.handle_error(self.logger, logging.WARNING,f"Skipping row due to missing client {client}. Name: {row}")
-                continue
-            
-            start_date = row.get('start_date').date() if pd.notna(row.get('start_date')) else None
-            end_date = row.get('end_date').date() if pd.notna(row.get('end_date')) else None
+            return None
 
-            # print("'Start date is {start_date}, end date is {end_date}')
-            if ( start_date and start_date <= today and 
-                (end_date is None or end_date >= today)):
-                client_monthly_budget = row.get('monthly_budget')
-                client_manager = ClientManager(self, client=client, client_monthly_budget=float(client_monthly_budget), today=today)
-                if not client_manager.any_errors:
-                    self.client_managers.append(client_manager)
+        return subscriptions_df
 
-        self.logger.info(f"Created {len(self.client_managers)} client tasks")
-        return
-
-    def timing_decorator(self, func):
+    def create_client_managers(self, subscriptions_df):
         """
-        A DECORATOR that logs the start and end time of the decorated function,
-        as well as its total execution time. If an exception occurs, it logs
-        the error and the time at which the function failed.
+        Create tasks for active clients based on the subscriptions. No active subscription means no tasks.
 
         Args:
-            func (Callable): The function to be decorated.
+            subscriptions_df (pandas.DataFrame): The subscriptions, as returned by read_subscriptions().
 
         Returns:
-            Callable: The wrapped function with timing and logging capabilities.
-
-        Raises:
-            Exception: Any exception raised by the decorated function is re-raised
-                       after logging.
+            None. Appends a ClientManager to self.client_managers for each active client.
         """
-        @functools.wraps(func)
-        async def wrapper(*args, **kwargs):
-            start_time = time.time()
-            self.logger.info(f"Starting {func.__name__}...")
-            try:
-                result = await func(*args, **kwargs)
-                end_time = time.time()
-                self.logger.info(f"{func.__name__} completed in {end_time - start_time:.2f} seconds")
-                return result
-            except Exception as e:
-                end_time = time.time()
-                msg = f"{func.__name__} failed after {end_time - start_time:.2f} seconds with error: {str(e)}"
-                self.handle_error(self.logger, logging.CRITICAL, msg)
-                raise
-        return wrapper
+        if subscriptions_df is None:
+            return
+        
+        today = self.today.date()
+        # print("'Today is {today}')
 
+        # Coerce the dates once and select today's active subscriptions with a vectorized mask
+        subscriptions_df = subscriptions_df.assign(
+            start_date=pd.to_datetime(subscriptions_df['start_date']).dt.normalize(),
+            end_date=pd.to_datetime(subscriptions_df['end_date']).dt.normalize()
+        )
+        today_ts = pd.Timestamp(today)
+
+        has_client = subscriptions_df['client'].notna() & (subscriptions_df['client'] != '')
+        for row in subscriptions_df.loc[~has_client].to_dict('records'):
+            self.handle_error(self.logger, logging.WARNING,f"Skipping row due to missing client. Name: {row}")
+
+        # NaT compares False, so a missing start date is never active
+        active = (has_client
+                  & (subscriptions_df['start_date'] <= today_ts)
+                  & (subscriptions_df['end_date'].isna() | (subscriptions_df['end_date'] >= today_ts)))
+
+        for client, client_monthly_budget in subscriptions_df.loc[active, ['client', 'monthly_budget']].itertuples(index=False, name=None):
+            # print("'Client is {client}')
+            client_manager = ClientManager(self, client=client, client_monthly_budget=float(client_monthly_budget), today=today)
+            if not client_manager.any_errors:
+                self.client_managers.append(client_manager)
 
+        self.logger.info(f"Created {len(self.client_managers)} client tasks")
+        return
+
+    @timing_decorator()
     def load_pricing_data(self, file_path):
         """
         Load pricing data from an Excel file and store it in self.df_prices.
@@ -342,7 +426,7 @@ class WebResearchApp:
         No exceptions are raised directly. All errors are logged using self.handle_error().
         
         Side Effects:
-        - Sets self.df_prices if loading is successful.
+        - Sets self.df_prices and self.pricing_models if loading is successful.
         - Logs warnings or errors using self.handle_error().
         """
         try:           
@@ -358,6 +442,8 @@ class WebResearchApp:
                 self.logger.warning("Some start dates could not be parsed. Please check your data.")
             
             self.df_prices = df_prices
+            # The models with any pricing, for reporting consumption of unpriced models
+            self.pricing_models = frozenset(df_prices['model'].unique().tolist())
             return df_prices
         except FileNotFoundError as e:
             msg=f"load_pricing_data, FileNotFoundError: {str(e)}"
@@ -392,51 +478,26 @@ class WebResearchApp:
             self.logger.error("Pricing data not loaded. Call load_pricing_data first.")
             return
 
-        for model in self.df_prices['model'].unique():
-            model_df = self.df_prices[self.df_prices['model'] == model].sort_values('start_date')
-            self.logger.info(f"Checking pricing for model: {model}")
-            
-            for i in range(len(model_df) - 1):
-                current_end = model_df.iloc[i]['end_date']
-                next_start = model_df.iloc[i+1]['start_date']
-                
-                if pd.isna(current_end):
-                    self.logger.warning(f"Open-ended period found for {model} starting {model_df.iloc[i]['start_date']}")
-                elif current_end < next_start:
-                    self.logger.info(f"Gap found between price periods for {model}: {current_end} to {next_start}")
-        
-        self.logger.info("Pricing sequentiality check completed.")
+        # Compare each period with the model's next one, all models at once
+        df_prices = self.df_prices.sort_values(['model', 'start_date'], kind='stable')
+        self.logger.info(f"Checking pricing for models: {', '.join(map(str, df_prices['model'].unique()))}")
 
-    def get_price(self, model, date, price_type):
-        """
-        Get the applicable price for a given model, date, and price type.
-        
-        Args:
-        model (str): The model name.
-        date (datetime): The date for which to get the price.
-        price_type (str): The type of price to retrieve (e.g., 'input_price').
-        
-        Returns:
-        float: The applicable price, or None if no price is found.
-        """
-        if self.df_prices is None:
-            self.logger.error("Pricing data not loaded. Call load_pricing_data first.")
-            return None
+        next_start = df_prices.groupby('model', sort=False)['start_date'].shift(-1)
+        has_next = df_prices['model'].duplicated(keep='last')
+        current_end = df_prices['end_date']
 
-        model_prices = self.df_prices[self.df_prices['model'] == model]
-        valid_prices = model_prices[
-            (model_prices['start_date'] <= date) & 
-            ((model_prices['end_date'] >= date) | (model_prices['end_date'].isna()))
-        ]
-        
-        if len(valid_prices) == 0:
-            previous_prices = model_prices[model_prices['start_date'] <= date]
-            if len(previous_prices) > 0:
-                return previous_prices.iloc[-1][price_type]
-            return None
-        
-        return valid_prices.iloc[-1][price_type]
+        open_ended = has_next & current_end.isna()
+        for model, start_date in df_prices.loc[open_ended, ['model', 'start_date']].itertuples(index=False, name=None):
+            self.logger.warning(f"Open-ended period found for {model} starting {start_date}")
 
+        # NaT compares False, so periods without an end or a next start are never gaps
+        gaps = has_next & (current_end < next_start)
+        for model, end_date, start_date in zip(df_prices.loc[gaps, 'model'], current_end[gaps], next_start[gaps]):
+            self.logger.info(f"Gap found between price periods for {model}: {end_date} to {start_date}")
+
+        self.logger.info("Pricing sequentiality check completed.")
+
+    @timing_decorator()
     def calculate_api_costs(self, consumption_filename, client, date_from=None, date_to=None):
         """
         Load pricing and consumption data, calculate API costs, and save results.
@@ -456,13 +517,14 @@ class WebResearchApp:
                 self.logger.error("Pricing data not loaded. Call load_pricing_data first.")
                 return None
 
-            # Load consumption data
-            df_consumption = self.storage_manager.read_parquet(consumption_filename, client=client)
+            # Load consumption data, only the columns needed for costing
+            df_consumption = self.storage_manager.read_parquet(
+                consumption_filename, client=client,
+                columns=['search_date', 'model', 'input_tokens', 'output_tokens', 'search_calls']
+            )
             # print('loaded consumption data')
             # Check for models in consumption data not present in pricing data
-            consumption_models = set(df_consumption['model'].unique())
-            pricing_models = set(self.df_prices['model'].unique())
-            missing_models = consumption_models - pricing_models
+            missing_models = set(df_consumption['model'].unique()).difference(self.pricing_models)
             missing_models_text = ', '.join(missing_models)
             if missing_models:
                 msg = f"The following models are present in consumption data but missing from pricing data: {missing_models_text}"
@@ -476,37 +538,49 @@ class WebResearchApp:
             
             # Filter consumption data based on date range
             if date_from or date_to:
-                mask = pd.Series(True, index=df_consumption.index)
-                if date_from:
-                    mask &= df_consumption['search_date'] >= date_from
-                if date_to:
-                    mask &= df_consumption['search_date'] <= date_to
+                search_dates = df_consumption['search_date']
+                if date_from and date_to:
+                    mask = search_dates.between(date_from, date_to)
+                elif date_from:
+                    mask = search_dates >= date_from
+                else:
+                    mask = search_dates <= date_to
                 df_consumption = df_consumption[mask]
             
             # print("After filtered consumption data")
             # print("date_from type:", type(date_from))
-            # Calculate costs
-            results = []
-            for _, row in df_consumption.iterrows():
-                model = row['model']
-                date = row['search_date']
-                daily_cost = 0
-                
-                for price_type, token_type in [('input_price', 'input_tokens'), 
-                                               ('output_price', 'output_tokens'), 
-                                               ('search_price', 'search_calls')]:
-                    price = self.get_price(model, date, price_type)
-                    if price:
-                        cost = (row[token_type] / 1e6) * price if 'tokens' in token_type else row[token_type] * price
-                        daily_cost += cost
-                
-                results.append({
-                    'date': date,
-                    'model': model,
-                    'cost': daily_cost
+            # Calculate costs. Each row takes the prices of the latest period for its model starting on
+            # or before its date, joined for all rows at once with merge_asof
+            if len(df_consumption) == 0:
+                costs_df = pd.DataFrame()
+            else:
+                price_columns = ['input_price', 'output_price', 'search_price']
+                df_prices = (self.df_prices.dropna(subset=['start_date'])
+                             .sort_values('start_date', kind='stable')[['model', 'start_date'] + price_columns])
+                df_prices['start_date'] = df_prices['start_date'].astype('datetime64[ns]')
+
+                df_rows = df_consumption[['search_date', 'model', 'input_tokens', 'output_tokens', 'search_calls']].copy()
+                df_rows['search_date'] = pd.to_datetime(df_rows['search_date']).astype('datetime64[ns]')
+                df_rows['row'] = range(len(df_rows))
+
+                # merge_asof can't join rows without a date, they get no price
+                dated = df_rows['search_date'].notna()
+                merged = pd.merge_asof(df_rows[dated].sort_values('search_date', kind='stable'), df_prices,
+                                       left_on='search_date', right_on='start_date', by='model',
+                                       direction='backward')
+                merged = pd.concat([merged, df_rows[~dated]]).sort_values('row')
+
+                # Missing prices cost nothing, as before
+                prices = merged[price_columns].fillna(0)
+                cost = ((merged['input_tokens'] / 1e6) * prices['input_price'] +
+                        (merged['output_tokens'] / 1e6) * prices['output_price'] +
+                        merged['search_calls'] * prices['search_price'])
+
+                costs_df = pd.DataFrame({
+                    'date': merged['search_date'].to_numpy(),
+                    'model': merged['model'].to_numpy(),
+                    'cost': cost.to_numpy()
                 })
-
-            costs_df = pd.DataFrame(results)
             
             # if no results in data range...
             if len(costs_df) == 0:
@@ -561,7 +635,7 @@ class WebResearchApp:
         1. Loads pricing data for API usage.
         2. Checks the sequentiality of pricing data.
         3. Creates client managers for each client.
-        4. Processes all clients asynchronously.
+        4. Processes all clients concurrently.
         5. Calculates and saves API costs for each client.
 
         Any critical errors during execution are logged and handled.
@@ -570,34 +644,49 @@ class WebResearchApp:
             None
         """
         try:
-            # Load pricing data
-            self.load_pricing_data(self.config['API_PRICING_FILENAME'])
+            # Read the pricing and subscriptions files concurrently, they are independent blocking reads
+            _, subscriptions_df = await asyncio.gather(
+                asyncio.to_thread(self.load_pricing_data, self.config['API_PRICING_FILENAME']),
+                asyncio.to_thread(self.read_subscriptions, self.config['SUBSCRIPTIONS_FILENAME'])
+            )
             self.check_pricing_sequentiality()
             # print("etablished pricing")
 
             # Create client managers
             # print("subscriptions filename is: ", self.config['SUBSCRIPTIONS_FILENAME'])
-            self.create_client_managers(self.config['SUBSCRIPTIONS_FILENAME'])
+            self.create_client_managers(subscriptions_df)
             # print(""etablished client managers: {self.client_managers}")
 
-            # Process clients asynchronously
-            for client_manager in self.client_managers:
-                # print("starting processing")
-                await client_manager.process_client()
+            # Process clients concurrently, up to MAX_CONCURRENT_CLIENTS at a time
+            client_semaphore = asyncio.Semaphore(self.config.get('MAX_CONCURRENT_CLIENTS', 4))
+
+            async def process_client(client_manager):
+                async with client_semaphore:
+                    await client_manager.process_client()
 
-            # Calculate and save API costs for each client
-            for client_manager in self.client_managers:
-                consumption_filename = self.config['DF_CONSUMPTION_FILENAME']
-                self.calculate_api_costs(
-                    consumption_filename=consumption_filename,
-                    client=client_manager.config['CLIENT']
-                )
+            results = await asyncio.gather(*(process_client(client_manager) for client_manager in self.client_managers),
+                                           return_exceptions=True)
+            for client_manager, result in zip(self.client_managers, results):
+                if isinstance(result, Exception):
+                    # Logged directly with the exception, as it was raised in the gather rather than here
+                    self.logger.error(f"Error processing client {client_manager.client}: {str(result)}", exc_info=result)
+
+            # Calculate and save API costs for each client, in threads as the pandas work is blocking
+            consumption_filename = self.config['DF_CONSUMPTION_FILENAME']
+            await asyncio.gather(*(asyncio.to_thread(self.calculate_api_costs,
+                                                     consumption_filename=consumption_filename,
+                                                     client=client_manager.config['CLIENT'])
+                                   for client_manager in self.client_managers))
 
             # maintain list of blog URL's
 
         except Exception as e:
             self.handle_error(self.logger, logging.CRITICAL, f"Error in main application run: {str(e)}")
 
+        finally:
+            await self.http_client.aclose()
+            self.stop_logging()
+
 
 def run_app():
     # Load environment variables from .env file
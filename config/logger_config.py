@@ -2,8 +2,9 @@
 
 import logging
 import os
+import re
 import time
-from logging.handlers import BaseRotatingHandler
+from logging.handlers import BaseRotatingHandler, MemoryHandler
 from enum import Enum
 
 class ErrorAction(Enum):
@@ -29,6 +30,9 @@ class LoggerConfig:
         self.max_log_size = 5 * 1024 * 1024  # 5 MB
         self.backup_count = 9  # Keep 9 backup files, plus the current on
 
+# The run timestamp embedded in each log filename, e.g. app_1718000000.log
+LOG_TIMESTAMP_RE = re.compile(r"_(\d+)\.log$")
+
 class NewFileForEachRunHandler(BaseRotatingHandler):
     def __init__(self, app, filename, mode='a', encoding=None, delay=False, max_files=10):
         self.app = app
@@ -47,16 +51,55 @@ class NewFileForEachRunHandler(BaseRotatingHandler):
         files = self.storage_manager.list_files(f"{base_name}*.log")
         
         if len(files) > self.max_files:
-            files.sort(key=lambda x: self.storage_manager.get_file_modification_time(x), reverse=True)
+            files.sort(key=self.file_timestamp, reverse=True)
             for old_file in files[self.max_files:]:
                 self.storage_manager.delete_file(old_file)
 
+    def file_timestamp(self, file_path):
+        """The run timestamp from the log filename, saving a storage call per file. Falls back to the modification time."""
+        match = LOG_TIMESTAMP_RE.search(file_path)
+        if match:
+            return int(match.group(1))
+        return self.storage_manager.get_file_modification_time(file_path)
+
     def emit(self, record):
         try:
-            msg = self.format(record)
-            self.storage_manager.append_to_file(msg + self.terminator, self.current_filename)
+            content = (self.format(record) + self.terminator).encode('utf-8')
+            self.storage_manager.append_bytes_to_file(content, self.current_filename)
         except Exception:
             self.handleError(record)
 
+    def emit_batch(self, records):
+        """Write several records with a single append, rather than one per record."""
+        records = [record for record in records if record.levelno >= self.level]
+        if not records:
+            return
+        try:
+            content = ''.join(self.format(record) + self.terminator for record in records).encode('utf-8')
+            self.storage_manager.append_bytes_to_file(content, self.current_filename)
+        except Exception:
+            self.handleError(records[-1])
+
     def close(self):
         super().close()
+
+class BufferedRunFileHandler(MemoryHandler):
+    """
+    Buffers records in memory and writes them to a NewFileForEachRunHandler in one append,
+    when the buffer is full, a record at flushLevel (ERROR by default) arrives, or a record
+    arrives flush_interval seconds or more after the oldest buffered one.
+    """
+
+    def __init__(self, target, capacity=1024, flushLevel=logging.ERROR, flushOnClose=True, flush_interval=5.0):
+        super().__init__(capacity, flushLevel=flushLevel, target=target, flushOnClose=flushOnClose)
+        self.flush_interval = flush_interval
+
+    def shouldFlush(self, record):
+        return (super().shouldFlush(record) or
+                record.created - self.buffer[0].created >= self.flush_interval)
+
+    def flush(self):
+        with self.lock:
+            if self.target and self.buffer:
+                self.target.emit_batch(self.buffer)
+                self.buffer.clear()
@@ -8,8 +8,27 @@ from dateutil.relativedelta import relativedelta
 if TYPE_CHECKING:
     from app import WebResearchApp
 
+# English month names by month number, for search periods. A plain tuple, as calendar.month_name
+# formats the name with strftime on every lookup
+MONTH_NAMES = ('', 'January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December')
+
+# The columns of a search history row, in order
+SEARCH_ROW_COLUMNS = (
+    'first_name', 'last_name', 'company', 'search_date', 'search_event_type', 'search_query', 'search_raw',
+    'url_facebook', 'url_linkedin', 'url_company', 'search_results', 'novelty_score', 'activity_score',
+    'services_need_score', 'total_score', 'email_date', 'email_content', 'email_batch_recipient'
+)
+
+# A search history row with every column set to None, copied and filled in by CandidateSearch.to_dict()
+SEARCH_ROW_TEMPLATE = dict.fromkeys(SEARCH_ROW_COLUMNS)
+
 class Candidate:
 
+    # Fixed attributes, no per-instance __dict__
+    __slots__ = ('app', 'first_name', 'last_name', 'company', 'position', 'searches', 'search_index', 'latest_search',
+                 'identity_hash')
+
     def __init__(self, app, first_name, last_name, company, position):
         """
         Initialize a Candidate object.
@@ -25,7 +44,13 @@ class Candidate:
         self.last_name = last_name
         self.company = company
         self.position = position
+        # Name and company are never reassigned, so the hash is computed once
+        self.identity_hash = hash((first_name, last_name, company))
         self.searches = []
+        # Position of each search in self.searches, keyed by id(), for O(1) lookup
+        self.search_index = {}
+        # The search with the latest search_date, kept up to date by add_search
+        self.latest_search = None
 
     def add_search(self, search_date, search_event_type, search_query, search_raw, url_facebook, url_linkedin, url_company,
                     search_results, novelty_score=None, activity_score=None, services_need_score=None, total_score=None):
@@ -51,7 +76,11 @@ class Candidate:
         """
         new_search = CandidateSearch(self, search_date, search_event_type, search_query, search_raw, url_facebook, url_linkedin, url_company,
                                     search_results, novelty_score, activity_score, services_need_score, total_score)
+        self.search_index[id(new_search)] = len(self.searches)
         self.searches.append(new_search)
+        # Strictly later only, so ties keep the first search added, as max() did
+        if self.latest_search is None or new_search.search_date > self.latest_search.search_date:
+            self.latest_search = new_search
         return new_search
 
     def get_latest_search(self):
@@ -61,7 +90,7 @@ class Candidate:
         Returns:
             CandidateSearch: The most recent CandidateSearch object, or None if no searches exist
         """
-        return max(self.searches, key=lambda s: s.search_date) if self.searches else None
+        return self.latest_search
 
     def get_previous_search(self, current_search):
         """
@@ -73,24 +102,34 @@ class Candidate:
         Returns:
             str: The search results of the previous search, or an empty string if there is no previous search
         """
-        if not self.searches or current_search not in self.searches:
-            return ""
-        
-        current_index = self.searches.index(current_search)
-        if current_index > 0:
+        current_index = self.search_index.get(id(current_search))
+        if current_index:
             return self.searches[current_index - 1].search_results
         return ""
 
-    def is_eligible_for_processing(self):
+    @staticmethod
+    def eligibility_cutoff():
+        """
+        The latest search date eligible for a new search, i.e. more than 30 whole days ago.
+        Compute once and pass to is_eligible_for_processing when checking many candidates.
+
+        :return: The cutoff datetime
+        """
+        return datetime.now() - timedelta(days=31)
+
+    def is_eligible_for_processing(self, cutoff=None):
         """
         Determine if the candidate is eligible for a new search based on the date of the last search.
         
+        :param cutoff: The latest eligible search date, from eligibility_cutoff(). Computed if not given.
         :return: True if eligible (no search in the last 30 days), False otherwise
         """
-        latest_search = self.get_latest_search()
+        latest_search = self.latest_search
         if not latest_search:
             return True
-        return (datetime.now() - latest_search.search_date).days > 30
+        if cutoff is None:
+            cutoff = self.eligibility_cutoff()
+        return latest_search.search_date <= cutoff
 
     def to_dict(self):
         """
@@ -130,11 +169,16 @@ class Candidate:
         
         :return: An integer hash value
         """
-        return hash((self.first_name, self.last_name, self.company))
+        return self.identity_hash
 
 
 class CandidateSearch:
 
+    # Fixed attributes, no per-instance __dict__
+    __slots__ = ('candidate', 'search_date', 'search_event_type', 'search_query', 'search_raw', 'url_facebook',
+                 'url_linkedin', 'url_company', 'search_results', 'novelty_score', 'activity_score',
+                 'services_need_score', 'total_score', 'email_content')
+
     def __init__(self, candidate, search_date, search_event_type, search_query, search_raw, url_facebook, url_linkedin, url_company,
                 search_results, novelty_score=None, activity_score=None, services_need_score=None, total_score=None, priority_reasoning=None):
         """
@@ -168,6 +212,7 @@ class CandidateSearch:
         self.activity_score = activity_score
         self.services_need_score = services_need_score
         self.total_score = total_score
+        self.email_content = None # drafted later, or speculatively during the search
 
     def set_search_scores(self, novelty_score, activity_score, services_need_score):
         """
@@ -205,29 +250,57 @@ class CandidateSearch:
         if previous_date > today:
             previous_date = today - relativedelta(months=3)
 
-        months = []
-        current = previous_date.replace(day=1)
+        # Months from the previous date's to today's, counted as integers
+        first_month = previous_date.year * 12 + previous_date.month - 1
+        month_count = today.year * 12 + today.month - 1 - first_month + 1
 
-        while current <= today:
-            months.append(current)
-            current += relativedelta(months=1)
+        def month_name(i):
+            year, month = divmod(first_month + i, 12)
+            return f"{MONTH_NAMES[month + 1]} {year}"
 
-        if len(months) == 0:
+        if month_count <= 0:
             return "Error: No valid months in range"
 
-        if len(months) == 1:
-            return months[0].strftime("%B %Y")
+        if month_count == 1:
+            return month_name(0)
+
+        if month_count == 2:
+            return f"{month_name(0)} and {month_name(1)}"
+
+        if month_count <= 6:
+            return f"{', '.join(month_name(i) for i in range(month_count - 1))}, and {month_name(month_count - 1)}"
+
+        # Longer periods are given as a range, so only the first and last names are built
+        return f"{month_name(0)} - {month_name(month_count - 1)}"
 
-        if len(months) <= 6:
-            month_names = [date.strftime("%B %Y") for date in months]
-            if len(month_names) == 2:
-                return f"{month_names[0]} and {month_names[1]}"
-            else:
-                return ", ".join(month_names[:-1]) + f", and {month_names[-1]}"
-        else:
-            start_date = months[0]
-            end_date = months[-1]
-            return f"{start_date.strftime('%B %Y')} - {end_date.strftime('%B %Y')}"
+    def to_row(self):
+        """
+        Convert this search's data to a tuple, in the order of SEARCH_ROW_COLUMNS.
+        Cheaper than to_dict() for building DataFrames of many searches.
+
+        Returns:
+            tuple: This search's data.
+        """
+        return (
+            self.candidate.first_name,
+            self.candidate.last_name,
+            self.candidate.company,
+            self.search_date,
+            self.search_event_type,
+            self.search_query,
+            self.search_raw,
+            self.url_facebook,
+            self.url_linkedin,
+            self.url_company,
+            self.search_results,
+            self.novelty_score,
+            self.activity_score,
+            self.services_need_score,
+            self.total_score,
+            None, #email_date placeholder, emails are updated later
+            self.email_content, #placeholder unless drafted speculatively, emails are updated later
+            None, #email_batch_recipient placeholder, emails are updated later
+        )
 
     def to_dict(self)                  :
         """
@@ -236,23 +309,23 @@ class CandidateSearch:
         Returns:
             Dict[str, Any]: A dictionary containing this search's data.
         """
-        return {
-            'first_name':self.candidate.first_name,
-            'last_name': self.candidate.last_name,
-            'company': self.candidate.company,
-            'search_date': self.search_date,
-            'search_event_type': self.search_event_type,
-            'search_query': self.search_query,
-            'search_raw': self.search_raw,
-            'url_facebook': self.url_facebook,
-            'url_linkedin': self.url_linkedin,
-            'url_company': self.url_company,
-            'search_results': self.search_results,
-            'novelty_score': self.novelty_score,
-            'activity_score': self.activity_score,
-            'services_need_score': self.services_need_score,
-            'total_score': self.total_score,
-            'email_date': None, #placeholder, emails are updated later
-            'email_content': None, #placeholder, emails are updated later
-            'email_batch_recipient':None, #placeholder, emails are updated later
-        }
\ No newline at end of file
+        # Copy the pre-built row, so the keys are not hashed and inserted afresh for each search.
+        # email_date and email_batch_recipient stay None, emails are updated later
+        row = SEARCH_ROW_TEMPLATE.copy()
+        row['first_name'] = self.candidate.first_name
+        row['last_name'] = self.candidate.last_name
+        row['company'] = self.candidate.company
+        row['search_date'] = self.search_date
+        row['search_event_type'] = self.search_event_type
+        row['search_query'] = self.search_query
+        row['search_raw'] = self.search_raw
+        row['url_facebook'] = self.url_facebook
+        row['url_linkedin'] = self.url_linkedin
+        row['url_company'] = self.url_company
+        row['search_results'] = self.search_results
+        row['novelty_score'] = self.novelty_score
+        row['activity_score'] = self.activity_score
+        row['services_need_score'] = self.services_need_score
+        row['total_score'] = self.total_score
+        row['email_content'] = self.email_content #placeholder unless drafted speculatively, emails are updated later
+        return row
\ No newline at end of file
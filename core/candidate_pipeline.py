@@ -1,3 +1,5 @@
+import re
+import asyncio
 import logging
 from datetime import datetime
 from typing import Dict, List, Any, Tuple, Optional
@@ -8,7 +10,23 @@ from agents.search_proposal import SearchProposalAgent
 from agents.url_extraction import URLextractionAgent
 from agents.target_score import TargetScoreAgent
 from agents.results_comparison import ResultsComparisonAgent
-from agents.base import AgentBase
+from agents.email_proposal import EmailProposalAgent
+from core.plan_cache import PlanCache
+from core.email_manager import EMAIL_NOVELTY_THRESHOLD
+
+# Web page boilerplate which search results often carry, and which is no use to the agents
+BOILERPLATE_RE = re.compile(r'(cookie policy|accept all cookies|we use cookies|subscribe to our newsletter|'
+                            r'sign up for our newsletter|all rights reserved|skip to (main )?content)', re.IGNORECASE)
+
+# Boilerplate is only dropped from lines shorter than this, longer lines may also hold facts
+MAX_BOILERPLATE_LINE_CHARS = 200
+
+# Lines longer than this are truncated before the search text is sent to the agents
+MAX_LINE_CHARS = 1500
+
+# Lines shorter than this (e.g. headings), and separator lines, are kept even when repeated
+MIN_DEDUPE_CHARS = 40
+SEPARATOR_RE = re.compile(r'^[-=_* ]+$')
 
 #======================================================================================
 # CANDIDATE PIPELINE
@@ -18,7 +36,7 @@ class CandidatePipeline:
     """
     Manages the pipeline for processing candidates, including search operations and result analysis.
     """
-    def __init__(self, app, config, llm, llm_advanced):
+    def __init__(self, app, config, llm, llm_advanced, llm_url_extraction=None):
         """
         Initialize the CandidatePipeline.
 
@@ -26,17 +44,22 @@ class CandidatePipeline:
             app (WebResearchApp): The main application instance.
             config (Dict[str, Any]): Configuration dictionary.
             llm (Any): Language model instance.
+            llm_advanced (Any): Language model instance for scoring and emails.
+            llm_url_extraction (Any, optional): Language model instance for URL extraction. Defaults to llm.
         """
         self.app = app
         self.config = config
         self.llm = llm
         self.llm_advanced = llm_advanced
+        self.llm_url_extraction = llm_url_extraction or llm
         self.perplexity_agent = PerplexityAgent(app)
         self.tavily_agent = TavilyAgent(app)
         self.search_proposal_agent = SearchProposalAgent(app)
         self.extract_urls_agent = URLextractionAgent(app)
         self.target_score_agent = TargetScoreAgent(app)
         self.results_comparison_agent = ResultsComparisonAgent(app)
+        self.email_proposal_agent = EmailProposalAgent(app)
+        self.plan_cache = PlanCache(app, config['CLIENT'])
 
     async def process(self, candidate, client, semaphore,
                       search_limiter_perplexity, search_limiter_tavily):
@@ -69,8 +92,11 @@ class CandidatePipeline:
             # Create search_period relative to previous search date
             search_period = candidate_search.get_search_period()
 
-            # Get search event type
-            search_event_type, consumption = await self.get_search_event_type(candidate, search_limiter_perplexity)
+            # Get search event type, loading the standard query template while it is searched for
+            (search_event_type, consumption), standard_query_template = await asyncio.gather(
+                self.get_search_event_type(candidate, search_limiter_perplexity),
+                # The prompt cache is shared by all agents, so any agent can load the standard query template
+                self.search_proposal_agent.aprompt_from_file("prompt_standardquery.txt", client=client))
             consumption_row.append(consumption)
             candidate_search.search_event_type = search_event_type
 
@@ -79,8 +105,6 @@ class CandidatePipeline:
             consumption_row.append(consumption)
             
             # append the standard query "fred bloggs at ACME ltd offical blog or case studies"
-            agent_base = AgentBase(self.app)
-            standard_query_template = agent_base.prompt_from_file("prompt_standardquery.txt", client=client)
             standard_query = standard_query_template.format(candidate=candidate, search_period=search_period)
             search_queries.append(standard_query)
 
@@ -91,27 +115,67 @@ class CandidatePipeline:
             search_results_list, consumption_list = await self.perform_searches(search_queries, search_limiter_perplexity, search_limiter_tavily)
             for consumption in consumption_list:
                 consumption_row.append(consumption)
-            search_raw = "/n===/n".join(search_results_list)
+            search_raw = "\n===\n".join(search_results_list)
             candidate_search.search_raw = search_raw
 
-            # Extract URL's for LinkedIn, Facebook and Company URL
-            url_facebook, url_linkedin, url_company, consumption = await self.extract_urls(candidate, search_raw, client)
-            consumption_row.append(consumption)
-            candidate_search.url_facebook = url_facebook
-            candidate_search.url_linkedin = url_linkedin
-            candidate_search.url_company  = url_company
-            
-            # Get activity scores
-            activity_score, services_need_score, priority_reasoning, consumption = await self.get_activity_scores(search_raw, candidate, search_period, client)
-            consumption_row.append(consumption)
-            candidate_search.search_results = priority_reasoning
+            # Strip boilerplate and repeats before the search results are sent to the agents
+            search_text = self.compact_search_text(search_raw)
+
+            # Optionally draft the email speculatively, as soon as the activity scores are in and while
+            # novelty is scored, rather than later for email candidates
+            email_task = None
+            draft_recorded = False
+
+            async def get_activity_scores_and_draft():
+                nonlocal email_task
+                scores_result = await self.get_activity_scores(search_text, candidate, search_period, client)
+                if self.config.get('SPECULATIVE_EMAIL', False):
+                    email_task = asyncio.create_task(self.email_proposal_agent.run(
+                        self.llm_advanced, candidate.first_name, candidate.last_name, candidate.company, scores_result[2], client))
+                return scores_result
+
+            # Extract URL's for LinkedIn, Facebook and Company URL, get activity scores and get novelty score.
+            # All only need the search results, so run them concurrently
+            previous_search_results = candidate.get_previous_search(candidate_search)
+            try:
+                urls_result, scores_result, novelty_result = await asyncio.gather(
+                    self.extract_urls(candidate, search_text, search_period, client),
+                    get_activity_scores_and_draft(),
+                    self.get_novelty_score(candidate, client, search_text, previous_search_results))
+
+                url_facebook, url_linkedin, url_company, consumption = urls_result
+                consumption_row.append(consumption)
+                candidate_search.url_facebook = url_facebook
+                candidate_search.url_linkedin = url_linkedin
+                candidate_search.url_company  = url_company
 
-            # Get novelty score
-            previous_search = candidate.get_previous_search(candidate_search)
-            novelty_score, novelty_reasoning, consumption = await self.get_novelty_score(candidate, client, search_raw, 
-                                                                                         previous_search.search_results if previous_search else "")
-            consumption_row.append(consumption)
-            candidate_search.novelty_score = novelty_score
+                activity_score, services_need_score, priority_reasoning, consumption = scores_result
+                consumption_row.append(consumption)
+                candidate_search.search_results = priority_reasoning
+
+                novelty_score, novelty_reasoning, consumption = novelty_result
+                consumption_row.append(consumption)
+                candidate_search.novelty_score = novelty_score
+
+                # Keep the draft only if the search is novel enough to be an email candidate.
+                # The draft is optional, if it fails the email is drafted as usual by the ClientManager
+                if email_task is not None and novelty_score > EMAIL_NOVELTY_THRESHOLD:
+                    try:
+                        email_content, consumption = await email_task
+                        consumption_row.append(consumption)
+                        draft_recorded = True
+                        candidate_search.email_content = email_content
+                    except Exception as e:
+                        msg = f"Speculative email draft failed for {candidate.first_name} {candidate.last_name}, drafting later: {str(e)}"
+                        self.app.handle_error(logging.WARNING, msg, e)
+            finally:
+                # Don't leave an unwanted or orphaned draft running, nor an unused failed draft's exception unretrieved.
+                # A discarded draft which completed was still paid for, so its consumption is recorded
+                if email_task is not None:
+                    if not email_task.done():
+                        email_task.cancel()
+                    elif not email_task.cancelled() and email_task.exception() is None and not draft_recorded:
+                        consumption_row.append(email_task.result()[1])
 
             # Calculate total scores
             candidate_search.set_search_scores(novelty_score, activity_score, services_need_score)
@@ -122,6 +186,34 @@ class CandidatePipeline:
 
             return candidate_search, consumption_row
 
+    @staticmethod
+    def compact_search_text(search_raw):
+        """
+        Reduce the raw search results to the text worth sending to the agents, cutting input tokens.
+        Short boilerplate lines and lines repeated across results are dropped, and very long lines are truncated.
+
+        Args:
+            search_raw (str): The raw search results.
+
+        Returns:
+            str: The compacted search results.
+        """
+        lines = []
+        seen = set()
+        for line in search_raw.splitlines():
+            if len(line) < MAX_BOILERPLATE_LINE_CHARS and BOILERPLATE_RE.search(line):
+                continue
+
+            key = " ".join(line.lower().split())
+            if len(key) >= MIN_DEDUPE_CHARS and not SEPARATOR_RE.match(key):
+                if key in seen:
+                    continue
+                seen.add(key)
+
+            lines.append(line[:MAX_LINE_CHARS])
+
+        return "\n".join(lines)
+
     async def get_search_event_type(self, candidate, search_limiter_perplexity):
         """
         Get the search event type which is specific to a candidate and their industry, so we can search for such events
@@ -136,7 +228,7 @@ class CandidatePipeline:
         async with search_limiter_perplexity:
             query = f"""What kind of events, blogs and updates are typically published by {candidate.first_name} {candidate.last_name}, 
             who works as {candidate.position} at this company: {candidate.company}. Ignore similar named companies and people. Focus on this one only."""
-            return await self.perplexity_agent.run(query)
+            return await self.perplexity_agent.run(query, client=self.config['CLIENT'])
 
     async def get_search_queries(self, candidate, client, search_event_type, search_period):
         """
@@ -160,7 +252,8 @@ class CandidatePipeline:
             'company': candidate.company,
             'search_sites_list': ['']
         }
-        return await self.search_proposal_agent.run(self.llm, params, client)
+        return await self.plan_cache.run(self.search_proposal_agent, self.llm, params, client,
+                                         'prompt_searchproposalagent.txt', search_period)
 
     async def perform_searches(self, search_queries, search_limiter_perplexity, search_limiter_tavily):
         """
@@ -174,33 +267,36 @@ class CandidatePipeline:
         Returns:
             Tuple[List[str], List[Dict[str, Any]]]: The search results and consumption data.
         """
-        search_results_list = []
-        consumption_list = []
-
-        # Perplexity searches
-        for search_query in search_queries:
+        async def perplexity_search(search_query):
             async with search_limiter_perplexity:
-                result, consumption = await self.perplexity_agent.run(search_query)
-                search_results_list.append(result)
-                consumption_list.append(consumption)
+                return await self.perplexity_agent.run(search_query, client=self.config['CLIENT'])
 
-        # Tavily search (first query only)
-        if self.config['MAX_TAVILY_SEARCHES'] > 0:
+        async def tavily_search(search_query):
             async with search_limiter_tavily:
-                result, consumption = await self.tavily_agent.run(search_queries[0], self.config)
-                search_results_list.append(self.tavily_agent.tavily_result_to_text(result))
-                consumption_list.append(consumption)
+                result, consumption = await self.tavily_agent.run(search_query, self.config)
+                return self.tavily_agent.tavily_result_to_text(result), consumption
+
+        # Perplexity searches, and a Tavily search of the first query only, run concurrently within the rate limits
+        searches = [perplexity_search(search_query) for search_query in search_queries]
+        if self.config['MAX_TAVILY_SEARCHES'] > 0:
+            searches.append(tavily_search(search_queries[0]))
+
+        # gather returns results in the order the searches were listed
+        results = await asyncio.gather(*searches)
+        search_results_list = [result for result, _ in results]
+        consumption_list = [consumption for _, consumption in results]
 
         return search_results_list, consumption_list
 
-    async def extract_urls(self, candidate, search_raw, client):
+    async def extract_urls(self, candidate, search_raw, search_period, client):
         """
         Multiple searches, Tavily and Perplexity, are produced. We need to extract the urls relevant to the search candidate.
 
         Args:
             candidate (Candidate): The candidate whose results are being merged.
+            search_raw (str): The raw search results
+            search_period (str): The search period, used to key the plan cache.
             client (str): The client identifier.
-            search_results (str): The raw search results
 
         Returns:
             Tuple[str, Dict[str, Any]]: The merged results and consumption data.
@@ -212,7 +308,8 @@ class CandidatePipeline:
             'search_raw': search_raw
         }
 
-        return await self.extract_urls_agent.run(self.llm, params, client)
+        return await self.plan_cache.run(self.extract_urls_agent, self.llm_url_extraction, params, client,
+                                         'prompt_urlextractionagent.txt', search_period)
 
     async def get_activity_scores(self, search_raw, candidate, search_period, client):
         """
@@ -233,7 +330,8 @@ class CandidatePipeline:
             'details': search_raw,
         }
 
-        return await self.target_score_agent.run(self.llm_advanced, params, client)
+        return await self.plan_cache.run(self.target_score_agent, self.llm_advanced, params, client,
+                                         'prompt_targetscoreagent.txt', search_period)
 
     async def get_novelty_score(self, candidate, client, search_results, previous_results):
         """
@@ -5,6 +5,10 @@ import io
 import os
 import logging
 import yaml
+try:
+    from yaml import CSafeLoader as YamlLoader  # libyaml's C parser, if available
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 import traceback
 from datetime import datetime
 from typing import Dict, List, Any, Tuple, Optional
@@ -16,11 +20,40 @@ from langchain_openai import ChatOpenAI
 from aiolimiter import AsyncLimiter
 
 from core.data_manager import DataManager
+from core.candidate import SEARCH_ROW_COLUMNS
 from core.candidate_pipeline import CandidatePipeline
 from core.email_manager import EmailManager
 from core.consumption_tracker import ConsumptionTracker
 from agents.email_proposal import EmailProposalAgent
 
+# Client config keys which must be present
+REQUIRED_CONFIG_KEYS = ('CLIENT',  'BATCH_SIZE', 'MINI_BATCH_SIZE',
+                        'LLM_SEARCH', 'LLM_EMAIL', 'MAX_TAVILY_SEARCHES', 'MAX_PPLX_SEARCHES',
+                        'EMAIL_BATCH_RECIPIENT', 'EMAIL_DAYS_OF_WEEK','EMAIL_USER','MAX_EMAILS')
+
+# The models permitted for LLM_SEARCH
+LLM_SEARCH_MODELS = frozenset(["gpt-4o-mini", "gpt-4o", "gpt-4"])
+
+# Client config value checks: (check on the config, error level, message if the check fails)
+CONFIG_VALIDATION_RULES = (
+    (lambda config: config.get('SEND_PROPOSED_EMAILS', None) in [True, False],
+     logging.CRITICAL, "Must specify SEND_PROPOSED_EMAILS as either True or False"),
+    (lambda config: 0 < config.get('MAX_TAVILY_SEARCHES', 0) < 20,
+     logging.ERROR, "MAX_TAVILY_SEARCHES must be between 1 and 20. Prefer 5."),
+    (lambda config: 0 < config.get('MAX_PPLX_SEARCHES', 0) < 10,
+     logging.ERROR, "MAX_PPLX_SEARCHES must be between 1 and 10. Prefer 2."),
+    (lambda config: 0 < config.get('BATCH_SIZE', 0) < 1000,
+     logging.ERROR, "BATCH SIZE must be between 1 and 1000."),
+    (lambda config: config.get('MINI_BATCH_SIZE', 0) <= config.get('BATCH_SIZE', 0),
+     logging.ERROR, "MINI BATCH SIZE must be <= BATCH_SIZE. Prefer 3 due to 20 calls/min limit with Perplexity."),
+    (lambda config: config.get('LLM_SEARCH') in LLM_SEARCH_MODELS,
+     logging.ERROR, "LLM_SEARCH must be an Open AI model: gpt-4o-mini, gpt-4o, or gpt-4."),
+    (lambda config: config.get('LLM_EMAIL').startswith("gpt-4o"),
+     logging.ERROR, "LLM_EMAIL must be an Open AI model: gpt-4o-mini, gpt-4o, gpt-4o-2024-05-13 etc.."),
+    (lambda config: config.get('EMAIL_DAYS_OF_WEEK'),
+     logging.ERROR, "There must be at least one day of the week when the client should be emailed with progress."),
+)
+
 #======================================================================================
 # CLIENT MANAGER
 #======================================================================================
@@ -56,8 +89,13 @@ class ClientManager:
             # print("init llm complete")
             self.llm_email = self.initialize_llm(model_name = self.config['LLM_EMAIL'])
             # print("init llm_email complete")
+            # URL extraction can optionally be routed to its own model, e.g. a self hosted OpenAI compatible server
+            self.llm_url_extraction = None
+            if self.config.get('LLM_URL_EXTRACTION'):
+                self.llm_url_extraction = self.initialize_llm(model_name = self.config['LLM_URL_EXTRACTION'],
+                                                              base_url = self.config.get('LLM_URL_EXTRACTION_BASE_URL'))
             self.email_manager = EmailManager(self.config, self.llm_email, self.client, self.app) 
-            self.candidate_pipeline = CandidatePipeline(self.app, self.config, self.llm, self.llm_email)
+            self.candidate_pipeline = CandidatePipeline(self.app, self.config, self.llm, self.llm_email, self.llm_url_extraction)
 
     def read_config_client(self):
         """
@@ -86,59 +124,37 @@ class ClientManager:
         else:
             config_content = self.storage_manager.read_file(config_file_path, client=self.client)
             try:
-                config = yaml.safe_load(config_content)
+                config = yaml.load(config_content, Loader=YamlLoader)
                 print(config)
             except yaml.YAMLError as e:
                 self.app.handle_error(self.app.logger, logging.CRITICAL, f"Error parsing client YAML configuration file for {config_file_path}: {str(e)}")
                 any_errors = True
 
         # Validate required configuration items
-        required_keys = ['CLIENT',  'BATCH_SIZE', 'MINI_BATCH_SIZE',
-                         'LLM_SEARCH', 'LLM_EMAIL', 'MAX_TAVILY_SEARCHES', 'MAX_PPLX_SEARCHES',
-                         'EMAIL_BATCH_RECIPIENT', 'EMAIL_DAYS_OF_WEEK','EMAIL_USER','MAX_EMAILS']
-
-        for key in required_keys:
+        for key in REQUIRED_CONFIG_KEYS:
             if key not in config:
                 self.app.handle_error(logging.CRITICAL, f"Missing required configuration key: {key}")
                 any_errors = True
                 return config, any_errors
 
         # Validate the values
-        if not config.get('SEND_PROPOSED_EMAILS', None) in [True, False]: 
-            self.app.handle_error(self.app.logger, logging.CRITICAL, "Must specify SEND_PROPOSED_EMAILS as either True or False")
-            any_errors = True
-
-        if not 0 < config.get('MAX_TAVILY_SEARCHES', 0) < 20:
-            self.app.handle_error(self.app.logger, logging.ERROR,"MAX_TAVILY_SEARCHES must be between 1 and 20. Prefer 5.")
-            any_errors = True
-
-        if not 0 < config.get('MAX_PPLX_SEARCHES', 0) < 10:
-            self.app.handle_error(self.app.logger, logging.ERROR,"MAX_PPLX_SEARCHES must be between 1 and 10. Prefer 2.")
-            any_errors = True
-
-        if not 0 < config.get('BATCH_SIZE', 0) < 1000:
-            self.app.handle_error(self.app.logger, logging.ERROR,"BATCH SIZE must be between 1 and 1000.")
-            any_errors = True
-
-        if config.get('MINI_BATCH_SIZE', 0) > config.get('BATCH_SIZE', 0):
-            self.app.handle_error(self.app.logger, logging.ERROR,"MINI BATCH SIZE must be <= BATCH_SIZE. Prefer 3 due to 20 calls/min limit with Perplexity.")
-            any_errors = True
-
-        if config.get('LLM_SEARCH') not in ["gpt-4o-mini", "gpt-4o", "gpt-4"]:
-            self.app.handle_error(self.app.logger, logging.ERROR,"LLM_SEARCH must be an Open AI model: gpt-4o-mini, gpt-4o, or gpt-4.")
-            any_errors = True
-
-        if not config.get('LLM_EMAIL').startswith("gpt-4o"):
-            self.app.handle_error(self.app.logger, logging.ERROR,"LLM_EMAIL must be an Open AI model: gpt-4o-mini, gpt-4o, gpt-4o-2024-05-13 etc..")
-            any_errors = True
-
-        if not config.get('EMAIL_DAYS_OF_WEEK'):
-            self.app.handle_error(self.app.logger, logging.ERROR,"There must be at least one day of the week when the client should be emailed with progress.")
-            any_errors = True
+        for check, error_level, msg in CONFIG_VALIDATION_RULES:
+            if not check(config):
+                self.app.handle_error(self.app.logger, error_level, msg)
+                any_errors = True
 
         # set Brave limit based on Tavily
         config['MAX_BRAVE_SEARCHES'] = config.get('MAX_TAVILY_SEARCHES', 0)
 
+        # lower case the email days once, for matching against today
+        email_days = config.get('EMAIL_DAYS_OF_WEEK')
+        if isinstance(email_days, (list, tuple)) and all(isinstance(day, str) for day in email_days):
+            config['EMAIL_DAYS_OF_WEEK'] = frozenset(day.lower() for day in email_days)
+        else:
+            self.app.handle_error(self.app.logger, logging.ERROR, "EMAIL_DAYS_OF_WEEK must be a list of day names, e.g. [Monday, Thursday].")
+            config['EMAIL_DAYS_OF_WEEK'] = frozenset()
+            any_errors = True
+
         # Load API keys and other sensitive data from environment variables
         env_vars = ['PPLX_API_KEY', 'TAVILY_API_KEY', 'OPENAI_API_KEY', 'BRAVE_API_KEY',
                     'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']
@@ -170,10 +186,12 @@ class ClientManager:
         df_consumption_filepath = self.app.config['DF_CONSUMPTION_FILENAME']
         current_month_start = self.today.replace(day=1)
         # print(f'current month start: {current_month_start}')
-        costs_month_to_date = self.app.calculate_api_costs( df_consumption_filepath, 
-                                                            self.client, 
-                                                            date_from=current_month_start, 
-                                                            date_to=None)
+        # pandas and storage work, so run off the event loop to not block other clients
+        costs_month_to_date = await asyncio.to_thread(self.app.calculate_api_costs,
+                                                      df_consumption_filepath,
+                                                      self.client,
+                                                      date_from=current_month_start,
+                                                      date_to=None)
 
         costs_month_to_date = min(costs_month_to_date['cost'].sum(),0)
 
@@ -184,6 +202,9 @@ class ClientManager:
         # continue to process client
         self.app.logger.info(f"Configuring pipeline for: {self.client} ")
 
+        # load the client's prompts into the shared cache before the agents need them
+        await self.email_proposal_agent.warm_prompts(self.client)
+
         df_search_tasks = self.data_manager.load_df_search_tasks(self.app.config['DF_SEARCH_TASKS_FILENAME'], client=self.client)
         self.app.logger.info(f"Loaded df_search_tasks for: {self.client} ")
 
@@ -194,7 +215,8 @@ class ClientManager:
         candidates = self.data_manager.create_candidates_from_dataframe(merged_df)
         self.app.logger.info(f"There are {str(len(candidates))} valid candidates for search.")
 
-        batch = self.data_manager.get_batch(candidates, self.config['BATCH_SIZE'])
+        # Candidates are equal by name and company, so this drops any repeats while keeping the batch order
+        batch = list(dict.fromkeys(self.data_manager.get_batch(candidates, self.config['BATCH_SIZE'])))
         self.app.logger.info(f"As instructed, this batch will process {str(len(batch))}.")
 
         semaphore = asyncio.Semaphore(10)
@@ -202,22 +224,12 @@ class ClientManager:
         search_limiter_tavily = AsyncLimiter(20, 60)
 
         searches_all = []
-        processed_candidates = set()  # Track which candidates we've already processed
 
-        async with ConsumptionTracker(self.app, self.client) as tracker:
+        async with ConsumptionTracker(self.app, self.client) as tracker, self.candidate_pipeline.plan_cache:
 
             # Process each mini batch sequentially
             for i in range(0, len(batch), self.config['MINI_BATCH_SIZE']):
                 current_mini_batch = batch[i:i+self.config['MINI_BATCH_SIZE']]
-                
-                # Filter out any candidates we've already processed
-                current_mini_batch = [
-                    candidate for candidate in current_mini_batch 
-                    if candidate not in processed_candidates
-                ]
-                
-                if not current_mini_batch:  # Skip if all candidates in this batch were already processed
-                    continue
 
                 # log activity
                 msg = f"Processing mini batch starting at index {i}. Batch Size: {self.config['BATCH_SIZE']}. Mini Batch Size: {self.config['MINI_BATCH_SIZE']}"
@@ -240,14 +252,23 @@ class ClientManager:
                         )
                     
                     try:
-                        # Process this mini batch
-                        results = await asyncio.gather(*tasks)
+                        # Process this mini batch. A failed candidate is logged and skipped,
+                        # without discarding the results of the others in the mini batch
+                        results = await asyncio.gather(*tasks, return_exceptions=True)
                         
                         # Log consumption and results
-                        for candidate, (search, consumptions) in zip(current_mini_batch, results):
+                        for candidate, result in zip(current_mini_batch, results):
+                            if isinstance(result, Exception):
+                                error_msg = f"Error processing {candidate.first_name} {candidate.last_name}, {candidate.company}: "
+                                error_msg += f"{type(result).__name__}: {str(result)}\n"
+                                error_msg += "".join(traceback.format_exception(type(result), result, result.__traceback__))
+                                self.app.logger.error(error_msg)
+                                print(error_msg)
+                                continue
+
+                            search, consumptions = result
                             searches_all.append(search)
                             tracker.add_consumption(consumptions)
-                            processed_candidates.add(candidate)  # Mark this candidate as processed
                             
                         # Log completion of this batch
                         msg = f"Completed processing mini batch starting at index {i}"
@@ -277,7 +298,9 @@ class ClientManager:
         # Save search history
         df_searches_filepath = self.app.config['DF_SEARCH_HISTORY_FILENAME']
         if searches_all:
-            df_searches = pd.DataFrame([search.to_dict() for search in searches_all])
+            # One row tuple per search, transposed into a list per column, so pandas builds each column in one pass
+            search_columns = zip(*(search.to_row() for search in searches_all))
+            df_searches = pd.DataFrame({column: list(values) for column, values in zip(SEARCH_ROW_COLUMNS, search_columns)})
             self.storage_manager.append_to_parquet(df_searches, df_searches_filepath, client=self.client)
             msg = f"Completed batch of searches"
             print(msg)
@@ -303,16 +326,13 @@ class ClientManager:
         self.app.logger.info(msg)
 
         today = self.app.today
-        if today.strftime("%A").lower() in [day.lower() for day in self.config['EMAIL_DAYS_OF_WEEK']]:
+        if today.strftime("%A").lower() in self.config['EMAIL_DAYS_OF_WEEK']:
             df_search_history = self.data_manager.load_or_create_df_search_history(self.app.config['DF_SEARCH_HISTORY_FILENAME'], client=self.client)
             df_email_candidates, consumption_get_email_candidates = await self.email_manager.get_email_candidates(df_search_history)
 
-            # convert consumption to dataframe
-            df_consumption_a = pd.DataFrame(consumption_get_email_candidates)
-            df_consumption_a['client'] = self.client
-            df_consumption_a['search_date'] = np.datetime64(self.app.today, 'us')
-            columns = ['client', 'search_date'] + [col for col in df_consumption_a.columns if col not in ['client', 'search_date']]
-            df_consumption_a = df_consumption_a[columns]
+            # consumption records, client and search_date first, converted to a dataframe once emails are processed
+            consumption_records = [{'client': self.client, 'search_date': today, **consumption}
+                                   for consumption in consumption_get_email_candidates]
 
             # how many searches have been conducted since the last time we sent emails?
             last_email_date = pd.Timestamp.min
@@ -321,7 +341,8 @@ class ClientManager:
                 if pd.isnull(last_email_date):
                     last_email_date = pd.Timestamp.min  # Encompass all search history if no valid date
 
-            searches_since_last_email = len(df_search_history[df_search_history['search_date'] > last_email_date])
+            # Count the mask directly, rather than copying the matching rows to count them
+            searches_since_last_email = int((df_search_history['search_date'] > last_email_date).sum())
 
             # log the sending of emails
             msg = f"Email actions planned:\n{df_email_candidates[['first_name', 'last_name', 'company', 'search_date']].to_string()}"
@@ -333,16 +354,42 @@ class ClientManager:
                 email_updates = []
                 email_consumption_total = {}
 
-                for index, candidate in df_email_candidates.iterrows():
-                    self.app.logger.info(f"Processing email for {candidate.first_name} {candidate.last_name}")
-                    email_status, email_update, consumption = await self.process_email_candidate(candidate, index)
-                    email_updates.append(email_update)
+                email_candidates = list(df_email_candidates.iterrows())
+
+                # Draft the emails concurrently, a few at a time, except those drafted speculatively during the search
+                to_draft = [position for position, (index, candidate) in enumerate(email_candidates)
+                            if not (pd.notna(candidate['email_content']) and candidate['email_content'])]
+                items = [email_candidates[position][1][['first_name', 'last_name', 'company', 'search_results']].to_dict()
+                         for position in to_draft]
+                drafts = [None] * len(email_candidates)
+                if items:
+                    results = await self.email_proposal_agent.run_batch(self.llm_email, items, self.client,
+                                                                        max_concurrency=max(1, min(self.config['MAX_EMAILS'], 10)))
+                    for position, result in zip(to_draft, results):
+                        drafts[position] = result
+
+                for (index, candidate), draft in zip(email_candidates, drafts):
+                    # A failed email is logged and skipped, without discarding the others
+                    try:
+                        if isinstance(draft, Exception):
+                            raise draft
+                        self.app.logger.info(f"Processing email for {candidate.first_name} {candidate.last_name}")
+                        email_status, email_update, consumption = await self.process_email_candidate(candidate, index, draft)
+                    except Exception as e:
+                        error_msg = f"Error processing email for {candidate.first_name} {candidate.last_name}: "
+                        error_msg += f"{type(e).__name__}: {str(e)}\n"
+                        error_msg += "".join(traceback.format_exception(type(e), e, e.__traceback__))
+                        self.app.logger.error(error_msg)
+                        print(error_msg)
+                        continue
 
                     # log progress
                     msg = f"Completed processing email for {candidate.first_name} {candidate.last_name}"
                     self.app.logger.info(msg)
                     print(msg)
 
+                    email_updates.append(email_update)
+
                     for key, value in consumption.items():
                         if key in ['function', 'model']:
                             email_consumption_total[key] = value  # Simply store the last value for string fields
@@ -350,8 +397,17 @@ class ClientManager:
                             email_consumption_total[key] = email_consumption_total.get(key, 0) + value  # Sum for numeric fields
 
                 # Update df_search_history with the email date, email content and recipient.
-                for update in email_updates:
-                    df_search_history.loc[update['index'], update['columns']] = update['values']
+                # The updates all set the same columns, so assign each column for all rows at once,
+                # which also keeps each column's dtype
+                if email_updates:
+                    columns = email_updates[0]['columns']
+                    if all(update['columns'] == columns for update in email_updates):
+                        indices = [update['index'] for update in email_updates]
+                        for position, column in enumerate(columns):
+                            df_search_history.loc[indices, column] = [update['values'][position] for update in email_updates]
+                    else:
+                        for update in email_updates:
+                            df_search_history.loc[update['index'], update['columns']] = update['values']
 
                 # save the updated file (Will get big over time!)
                 self.storage_manager.to_parquet(df_search_history, self.app.config['DF_SEARCH_HISTORY_FILENAME'], client=self.client)
@@ -365,42 +421,54 @@ class ClientManager:
                 print(msg)
                 self.app.logger.info(msg)
 
-                # convert consumption to dataframe
-                df_consumption_b = pd.DataFrame([{**{'client': self.client, 'search_date': today}, **email_consumption_total}])
+                # convert consumption to dataframe, in one go rather than concatenating dataframes
+                consumption_records.append({'client': self.client, 'search_date': today, **email_consumption_total})
+                df_consumption = pd.DataFrame(consumption_records)
 
-                # ensure consumption_a and consumption_b have same date format, pandas datetime microseconds (datetime[us]), not nanoseconds
-                df_consumption_b['search_date'] = df_consumption_b['search_date'].astype('datetime64[us]')
-
-                # pandas concat the two consumptions
-                df_consumption = pd.concat([df_consumption_a, df_consumption_b], axis=0, ignore_index=True)
+                # pandas datetime microseconds (datetime[us]), not nanoseconds, as in the consumption file
+                df_consumption['search_date'] = df_consumption['search_date'].astype('datetime64[us]')
 
                 self.storage_manager.append_to_parquet(df_consumption, self.app.config['DF_CONSUMPTION_FILENAME'], client=self.client)
 
         else:
-            msg = f"No emails sent. Today is {today.strftime('%A')}, which is not a designated day: {str(self.config['EMAIL_DAYS_OF_WEEK'])} for {self.client}"
+            msg = f"No emails sent. Today is {today.strftime('%A')}, which is not a designated day: {', '.join(sorted(self.config['EMAIL_DAYS_OF_WEEK']))} for {self.client}"
             print(msg)
             self.app.logger.info(msg)
 
 
-    async def process_email_candidate(self, candidate, index):
+    async def process_email_candidate(self, candidate, index, draft=None):
         """
         Process an individual email candidate.
 
         Args:
             candidate (pd.Series): The candidate's information.
             index: The index of the candidate in the DataFrame.
+            draft (Tuple[str, Dict[str, Any]], optional): The email content and consumption, if already drafted.
 
         Returns:
             Tuple[bool, Dict[str, Any], Dict[str, Any]]: A tuple containing the email status, update information, and consumption data.
         """
-        email_content, consumption = await self.email_proposal_agent.run(
-            self.llm_email,
-            candidate['first_name'],
-            candidate['last_name'],
-            candidate['company'],
-            candidate['search_results'],
-            self.client
-        )
+        # reuse the draft if one was made already, or speculatively during the search
+        if draft is not None:
+            email_content, consumption = draft
+        elif pd.notna(candidate['email_content']) and candidate['email_content']:
+            email_content = candidate['email_content']
+            consumption = self.email_proposal_agent.log_consumption(
+                function_name='email_proposal_agent',
+                model=self.config['LLM_EMAIL'],
+                search_calls=0,
+                input_tokens=0,
+                output_tokens=0
+            )
+        else:
+            email_content, consumption = await self.email_proposal_agent.run(
+                self.llm_email,
+                candidate['first_name'],
+                candidate['last_name'],
+                candidate['company'],
+                candidate['search_results'],
+                self.client
+            )
 
         email_sent_date = self.app.today
 
@@ -459,18 +527,22 @@ class ClientManager:
         # log the outcome
         self.app.logger.info(msg)
 
-    def initialize_llm(self, model_name):
+    def initialize_llm(self, model_name, base_url=None):
         """
         Initialize the language model for the client.
         OpenAI is preferred because of tool calling capabilities in the small (cheap) model, GPT-4o-mini.
 
+        Args:
+            model_name (str): The model name.
+            base_url (str, optional): Base URL of an OpenAI compatible API, e.g. a vLLM server. Defaults to OpenAI.
+
         Returns:
             ChatOpenAI: An instance of the ChatOpenAI model.
         """
         # print(""Initializing ChatOpenAI LLM...{model_name}. Key: {os.getenv('OPENAI_API_KEY')}")
 
         try:
-            llm = ChatOpenAI(model_name=model_name, temperature=0.5)
+            llm = ChatOpenAI(model_name=model_name, temperature=0.5, base_url=base_url, http_async_client=self.app.http_client)
         except Exception as e:
             print(e)
         # print(""DONE: Initializing ChatOpenAI LLM...{model_name}")
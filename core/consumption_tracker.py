@@ -2,6 +2,12 @@
 
 import pandas as pd
 
+# The consumption file's columns, in order
+CONSUMPTION_COLUMNS = ('client', 'search_date', 'function', 'model', 'search_calls', 'input_tokens', 'output_tokens')
+
+# The fields every consumption record must provide, client and search_date are added if missing
+REQUIRED_CONSUMPTION_FIELDS = ('function', 'model', 'search_calls', 'input_tokens', 'output_tokens')
+
 class ConsumptionTracker:
     """
     An asynchronous context manager that tracks and guarantees the saving of API consumption data.
@@ -26,7 +32,8 @@ class ConsumptionTracker:
         """
         self.app = app
         self.client = client
-        self.consumptions = []
+        # Records are buffered column by column, and made a DataFrame once on exit
+        self.columns = {column: [] for column in CONSUMPTION_COLUMNS}
         # Store creation time in microsecond precision
         self.search_date = pd.Timestamp.now().floor('us')
         
@@ -38,24 +45,15 @@ class ConsumptionTracker:
         Exit the async context and save all consumption data.
         Ensures all data has proper client and search_date fields in microsecond precision.
         """
-        if self.consumptions:
-            # Create DataFrame from collected consumption data
-            df_consumption = pd.DataFrame(self.consumptions)
-            
-            # Ensure datetime precision is microseconds
-            if 'search_date' in df_consumption.columns:
-                df_consumption['search_date'] = pd.to_datetime(df_consumption['search_date']).dt.floor('us')
-            else:
-                df_consumption['search_date'] = self.search_date
+        if self.columns['function']:
+            # Create DataFrame from collected consumption data, client and search_date first
+            df_consumption = pd.DataFrame(self.columns)
             
-            # Ensure client field exists
-            if 'client' not in df_consumption.columns:
-                df_consumption['client'] = self.client
-                
-            # Reorder columns to ensure client and search_date are first
-            columns = ['client', 'search_date'] + [col for col in df_consumption.columns 
-                                                 if col not in ['client', 'search_date']]
-            df_consumption = df_consumption[columns]
+            # Ensure datetime precision is microseconds, once for all records
+            search_dates = df_consumption['search_date']
+            if not pd.api.types.is_datetime64_any_dtype(search_dates):
+                search_dates = pd.to_datetime(search_dates)
+            df_consumption['search_date'] = search_dates.dt.floor('us')
             
             # Append to parquet file
             consumption_filepath = self.app.config['DF_CONSUMPTION_FILENAME']
@@ -84,40 +82,29 @@ class ConsumptionTracker:
         if isinstance(consumption_data, list):
             # Process list of consumption records
             for record in consumption_data:
-                processed_record = self._process_record(record)
-                self.consumptions.append(processed_record)
+                self._add_record(record)
         else:
             # Process single consumption record
-            processed_record = self._process_record(consumption_data)
-            self.consumptions.append(processed_record)
+            self._add_record(consumption_data)
     
-    def _process_record(self, record):
+    def _add_record(self, record):
         """
-        Process a single consumption record to ensure it has all required fields.
+        Validate a single consumption record and append its fields to the column buffers.
+        Client and search_date are added if missing, search_date is floored to microseconds on exit.
         
         Args:
-            record (dict): The consumption record to process
-            
-        Returns:
-            dict: Processed record with all required fields
+            record (dict): The consumption record to add
+
+        Raises:
+            ValueError: If the record is missing a required field
         """
-        processed = record.copy()
-        
-        # Add client if missing
-        if 'client' not in processed:
-            processed['client'] = self.client
-            
-        # Add or normalize search_date
-        if 'search_date' not in processed:
-            processed['search_date'] = self.search_date
-        else:
-            # Ensure microsecond precision
-            processed['search_date'] = pd.to_datetime(processed['search_date']).floor('us')
-            
         # Validate required fields
-        required_fields = ['function', 'model', 'search_calls', 'input_tokens', 'output_tokens']
-        missing_fields = [field for field in required_fields if field not in processed]
+        missing_fields = [field for field in REQUIRED_CONSUMPTION_FIELDS if field not in record]
         if missing_fields:
             raise ValueError(f"Consumption record missing required fields: {missing_fields}")
-            
-        return processed
+
+        columns = self.columns
+        columns['client'].append(record.get('client', self.client))
+        columns['search_date'].append(record.get('search_date', self.search_date))
+        for field in REQUIRED_CONSUMPTION_FIELDS:
+            columns[field].append(record[field])
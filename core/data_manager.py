@@ -266,7 +266,8 @@ class DataManager:
             :return: A list of selected Candidate objects
             """
             # Filter eligible candidates
-            eligible_candidates = [c for c in candidates if c.is_eligible_for_processing()]
+            cutoff = Candidate.eligibility_cutoff()
+            eligible_candidates = [c for c in candidates if c.is_eligible_for_processing(cutoff)]
 
             # Separate candidates without previous searches and those with searches
             new_candidates = [c for c in eligible_candidates if not c.searches]
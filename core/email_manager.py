@@ -30,6 +30,9 @@ from agents.results_ranking import SearchResultsRankingAgent
 # EMAIL MANAGER FOR AMAZON SES EMAILS
 #======================================================================================
 
+# Searches must score above this novelty to be considered for an email
+EMAIL_NOVELTY_THRESHOLD = 5
+
 class EmailManager:
     """
     Manages email-related operations including candidate selection for emails and email sending via Amazon SES.
@@ -45,6 +48,7 @@ class EmailManager:
         self.email_user = config_client['EMAIL_USER']
         self.email_recipient = config_client['EMAIL_BATCH_RECIPIENT']
         self.max_emails = config_client['MAX_EMAILS']
+        self.ranking_shard_size = config_client.get('RANKING_SHARD_SIZE', 6)
         self.client = client
         self.llm_email = llm_email
         self.app = app
@@ -90,7 +94,7 @@ class EmailManager:
 
         # no apply filters to get candidates
         filtered_df = df[
-            (df['novelty_score'] > 5) & # reasonably novel
+            (df['novelty_score'] > EMAIL_NOVELTY_THRESHOLD) & # reasonably novel
             (df['email_date'].isna()) & # the results of this search havn't been emailed
             ((self.app.today - df['search_date']).dt.days <= 31) & # search is less than a month old
             df.apply(lambda row: get_last_email_date(row, df), axis=1)  # no recent emails about this person
@@ -111,8 +115,8 @@ class EmailManager:
         # If all the top scores are the same, how do we differentiate?
         if top_score_count > self.max_emails:
 
-            # we will rank the records, one batch at a time, using the SearchResultsRankingAgent
-            batch_size = 6
+            # we will rank the records in shards, all shards concurrently, using the SearchResultsRankingAgent
+            batch_size = self.ranking_shard_size
 
             # create the ranking agent
             ranking_agent = SearchResultsRankingAgent(self.app)
@@ -120,6 +124,7 @@ class EmailManager:
             # blank list to receive rankings
             rankings = []
             consumption = []
+            texts_list = []
 
             # for each batch of the data, up to the top_score_count
             for i in range(0, len(sorted_df[0:top_score_count]), batch_size):
@@ -134,10 +139,17 @@ class EmailManager:
                     texts += f'<text first_name="{row["first_name"]}", last_name="{row["last_name"]}", company="{row["company"]}">\n'
                     texts += f'{row["search_results"]}\n'
                     texts += '</text>\n'
-                texts += f'There are {top_score_count} texts. You must return {top_score_count} rankings'
+                # count the texts in this shard only, else the model is asked for rankings it cannot return
+                texts += f'There are {len(batch)} texts. You must return {len(batch)} rankings'
+                texts_list.append(texts)
+
+            # get the ranking agent's results, all batches concurrently
+            results = await ranking_agent.run_batch(self.llm_email, texts_list, self.client)
 
-                # get the ranking agent's results
-                batch_rankings, consumption_item = await ranking_agent.run(self.llm_email, texts, self.client)
+            for result in results:
+                if isinstance(result, Exception):
+                    continue
+                batch_rankings, consumption_item = result
 
                 # add the rankings to the list
                 rankings = rankings + batch_rankings
@@ -0,0 +1,137 @@
+"""Plan cache for reusing agent outputs for a candidate across runs."""
+
+import json
+import time
+import hashlib
+import logging
+
+class PlanCache:
+    """
+    An asynchronous context manager which caches agent outputs per candidate and search period,
+    so a repeated run within the TTL (e.g. after a failed run) doesn't repeat the same LLM calls.
+
+    Entries are loaded from the client's folder on entry and saved on exit. The key includes the
+    agent's prompt text, so editing a prompt invalidates its entries. Agents with cacheable = False
+    are always run.
+    """
+
+    def __init__(self, app, client):
+        """
+        Initialize the plan cache.
+
+        Args:
+            app (WebResearchApp): Main application instance
+            client (str): Client identifier
+        """
+        self.app = app
+        self.client = client
+        self.filename = app.config.get('PLAN_CACHE_FILENAME', 'plan_cache.json')
+        self.ttl = app.config.get('PLAN_CACHE_TTL_HOURS', 24) * 60 * 60
+        self.entries = {}
+        self.updated = False
+
+    async def __aenter__(self):
+        self.load()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """
+        Exit the async context and save the cache, if any entries were added.
+        """
+        if self.updated:
+            self.save()
+
+    def load(self):
+        """
+        Load unexpired entries from the client's cache file, if it exists.
+        """
+        self.entries = {}
+        if not self.ttl:
+            return
+
+        try:
+            if self.app.storage_manager.file_exists(self.filename, client=self.client):
+                content = self.app.storage_manager.read_file(self.filename, client=self.client)
+                entries = json.loads(content) if content else {}
+                now = time.time()
+                self.entries = {key: entry for key, entry in entries.items()
+                                if now - entry['timestamp'] <= self.ttl}
+        except Exception as e:
+            msg = f"PlanCache, could not load {self.filename}, starting empty: {str(e)}"
+            self.app.handle_error(logging.WARNING, msg)
+
+    def save(self):
+        """
+        Save the cache entries to the client's cache file.
+        """
+        try:
+            self.app.storage_manager.write_file(json.dumps(self.entries), self.filename, client=self.client)
+            self.updated = False
+        except Exception as e:
+            msg = f"PlanCache, could not save {self.filename}: {str(e)}"
+            self.app.handle_error(logging.WARNING, msg)
+
+    def make_key(self, agent, params, search_period, prompt_text):
+        """
+        Build the cache key for an agent call on a candidate.
+
+        Args:
+            agent (AgentBase): The agent being called.
+            params (dict): The agent's params, containing first_name, last_name and company.
+            search_period (str): The period being searched.
+            prompt_text (str): The agent's prompt.
+
+        Returns:
+            str: A hex digest identifying the call.
+        """
+        key_parts = [agent.__class__.__name__, self.client, params['first_name'], params['last_name'],
+                     params['company'], search_period, prompt_text]
+        return hashlib.sha256(json.dumps(key_parts).encode('utf-8')).hexdigest()
+
+    async def run(self, agent, llm, params, client, prompt_file, search_period):
+        """
+        Run an agent, returning its cached output if this candidate and period was processed within the TTL.
+
+        Args:
+            agent (AgentBase): The agent to run, whose run() returns a tuple ending in a consumption dict.
+            llm: The language model to use.
+            params (dict): The agent's params.
+            client (str): The client identifier.
+            prompt_file (str): The filename of the agent's prompt.
+            search_period (str): The period being searched.
+
+        Returns:
+            tuple: The agent's output. On a cache hit, the consumption records zero usage.
+        """
+        if not self.ttl or not agent.cacheable:
+            return await agent.run(llm, params, client)
+
+        prompt_text = await agent.aprompt_from_file(prompt_file, client=client)
+        key = self.make_key(agent, params, search_period, prompt_text)
+
+        entry = self.entries.get(key)
+        if entry is not None and time.time() - entry['timestamp'] <= self.ttl:
+            consumption = agent.log_consumption(
+                function_name=entry['function'],
+                model=entry['model'],
+                search_calls=0,
+                input_tokens=0,
+                output_tokens=0
+            )
+            return (*json.loads(entry['values']), consumption)
+
+        result = await agent.run(llm, params, client)
+
+        # Don't cache failures, the agents return None or model 'unknown' on error
+        if result is not None and result[-1].get('model') != 'unknown':
+            *values, consumption = result
+            self.entries[key] = {
+                'timestamp': time.time(),
+                'function': consumption['function'],
+                'model': consumption['model'],
+                # Serialized, so callers mutating the returned values can't alter the entry
+                'values': json.dumps(values)
+            }
+            self.updated = True
+
+        return result
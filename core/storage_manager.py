@@ -9,6 +9,11 @@ from azure.storage.blob import BlobServiceClient
 import pandas as pd
 import io
 from typing import Union
+try:
+    import xlsxwriter  # Faster Excel writer than openpyxl, if available
+    EXCEL_WRITER_ENGINE = 'xlsxwriter'
+except ImportError:
+    EXCEL_WRITER_ENGINE = 'openpyxl'
 
 #======================================================================================
 # Storage Manager
@@ -236,6 +241,29 @@ class StorageManager:
         except Exception as e:
             self.app.handle_error(self.app.logger, logging.CRITICAL, f"Error appending file {full_path}: {str(e)}")
 
+    def append_bytes_to_file(self, content, file_path, client=None):
+        """
+        Append already encoded content to a file. Used by the logger, as appending bytes avoids
+        decoding and re-encoding the whole existing blob on every append.
+
+        Args:
+            content (bytes): The UTF-8 encoded content to append.
+            file_path (str): The relative path of the file to append to.
+            client (str, optional): The client name, used as a subfolder.
+        """
+        full_path = self.get_file_path(file_path, client)
+        try:
+            if self.environment == 'PROD':
+                blob_client = self.blob_service_client.get_blob_client(container=self.container_name, blob=full_path)
+                if blob_client.exists():
+                    content = blob_client.download_blob().readall() + content
+                blob_client.upload_blob(content, overwrite=True)
+            else:
+                with open(full_path, 'ab') as file:
+                    file.write(content)
+        except Exception as e:
+            self.app.handle_error(self.app.logger, logging.CRITICAL, f"Error appending file {full_path}: {str(e)}")
+
     def file_exists(self, file_path, client=None):
         """
         Check if a file exists.
@@ -321,7 +349,7 @@ class StorageManager:
         try:
             if self.environment == 'PROD':
                 buffer = io.BytesIO()
-                with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
+                with pd.ExcelWriter(buffer, engine=EXCEL_WRITER_ENGINE) as writer:
                     df.to_excel(writer, **kwargs)
                 buffer.seek(0)
                 
@@ -329,19 +357,20 @@ class StorageManager:
                 blob_client.upload_blob(buffer.getvalue(), overwrite=True)
             else:
                 os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                df.to_excel(full_path, **kwargs)
+                df.to_excel(full_path, engine=EXCEL_WRITER_ENGINE, **kwargs)
         except Exception as e:
             msg = f"Error writing Excel file {full_path}: {str(e)}"
             self.app.handle_error(self.app.logger, logging.CRITICAL, msg)
             raise
 
-    def read_parquet(self, file_path, client=None):
+    def read_parquet(self, file_path, client=None, columns=None):
         """
         Read a Parquet file and return it as a pandas DataFrame.
 
         Args:
             file_path (str): The relative path of the Parquet file to read.
             client (str, optional): The client name, used as a subfolder.
+            columns (list, optional): Read only these columns, the others are never decoded.
 
         Returns:
             pd.DataFrame: The contents of the Parquet file as a DataFrame.
@@ -351,9 +380,9 @@ class StorageManager:
             if self.environment == 'PROD':
                 blob_client = self.blob_service_client.get_blob_client(container=self.container_name, blob=full_path)
                 stream = blob_client.download_blob()
-                return pd.read_parquet(io.BytesIO(stream.readall()))
+                return pd.read_parquet(io.BytesIO(stream.readall()), columns=columns)
             else:
-                return pd.read_parquet(full_path)
+                return pd.read_parquet(full_path, columns=columns)
         except Exception as e:
             msg = f"Error reading Parquet file {full_path}: {str(e)}"
             self.app.handle_error(self.app.logger, logging.CRITICAL, msg)